@@ -0,0 +1,276 @@
+""" Performance benchmarks
+
+Run from the console directory, results are printed as JSON:
+
+    python -m uart.benchmark throughput --max-size 1048576
+    python -m uart.benchmark batch --size 256
+    python -m uart.benchmark der
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from pyasn1.codec.der import decoder as asn1_decoder
+from pyasn1.codec.der import encoder as asn1_encoder
+
+from .core import signature_sequence
+from .der import decode_signature
+from .der import encode_signature
+from .gost.gost341012 import CURVE_PARAMS
+from .gost.gost341012 import DEFAULT_CURVE
+from .gost.gost341012 import GOST3410Curve
+from .gost.gost341012 import private_key
+from .gost.gost341012 import public_key
+from .gost.gost341012 import sign
+from .gost.gost341112 import BACKENDS
+from .gost.gost341112 import GOST341112
+from .gost.gost341112 import digest_many
+from .gost.gost341112 import numpy
+from .gost.utils import hexdec
+from .gost.utils import hexenc
+from .structs import SignatureSequence
+
+
+BATCH_COUNTS = (1, 10, 100, 1000, 10000, 100000)
+THROUGHPUT_SIZES = (0, 64, 1 << 10, 64 << 10, 1 << 20, 16 << 20, 64 << 20)
+
+# RFC 6986 examples, messages are given as big-endian numbers there
+RFC6986_M1 = hexdec(
+    "323130393837363534333231303938373635343332313039383736353433323130"
+    "393837363534333231303938373635343332313039383736353433323130"
+)[::-1]
+RFC6986_M2 = hexdec(
+    "fbe2e5f0eee3c820fbeafaebef20fffbf0e1e0f0f520e0ed20e8ece0ebe5f0f2f1"
+    "20fff0eeec20f120faf2fee5e2202ce8f6f3ede220e8e6eee1e8f0f2d1202ce8f0"
+    "f2e5e220e5d1"
+)[::-1]
+RFC6986_VECTORS = (
+    ("M1", RFC6986_M1, 512,
+     "1b54d01a4af5b9d5cc3d86d68d285462b19abc2475222f35c085122be4ba1ffa"
+     "00ad30f8767b3a82384c6574f024c311e2a481332b08ef7f41797891c1646f48"),
+    ("M1", RFC6986_M1, 256,
+     "9d151eefd8590b89daa6ba6cb74af9275dd051026bb149a452fd84e5e57b5500"),
+    ("M2", RFC6986_M2, 512,
+     "1e88e62226bfca6f9994f1f2d51569e0daf8475a3b0fe61a5300eee46d961376"
+     "035fe83549ada2b8620fcd7c496ce5b33f0cb9dddc2b6460143b03dabac9fb28"),
+    ("M2", RFC6986_M2, 256,
+     "9dd2fe4e90409e5da87f53976d7405b0c0cac628fc669a741d50063c557e8f50"),
+)
+
+
+def _scalar_backend(name):
+    def digest(data, digest_size):
+        return GOST341112(data, digest_size, backend=name).digest()
+    return digest
+
+
+def hash_backends():
+    """ All available ways to compute a single digest
+
+    :returns: backend name to ``digest(data, digest_size)`` function
+    """
+    backends = dict((name, _scalar_backend(name)) for name in BACKENDS)
+    if numpy is not None:
+        backends["numpy"] = lambda data, digest_size: digest_many([data], digest_size)[0]
+    return backends
+
+
+def check_vectors(backends):
+    """ Check every backend against RFC 6986 examples
+
+    :returns: backend name to {"M1-512": bool, ...}
+    """
+    res = {}
+    for name, digest in backends.items():
+        res[name] = dict(
+            ("%s-%d" % (vector, digest_size), hexenc(digest(msg, digest_size)) == expected)
+            for vector, msg, digest_size, expected in RFC6986_VECTORS
+        )
+    return res
+
+
+def bench_throughput(sizes=THROUGHPUT_SIZES, digest_size=512, min_time=0.5, budget=60.0):
+    """ Hashing rate and per-block latency of every available backend
+
+    Every measurement is repeated until it takes at least ``min_time``
+    seconds. A size is skipped for a backend when the rate measured on
+    the previous size predicts it would take more than ``budget`` seconds.
+    """
+    backends = hash_backends()
+    vectors = check_vectors(backends)
+    report = {
+        "benchmark": "streebog_throughput",
+        "python": platform.python_version(),
+        "numpy": numpy.__version__ if numpy is not None else None,
+        "digest_size": digest_size,
+        "vectors": vectors,
+        "results": [],
+    }
+    if not all(all(checks.values()) for checks in vectors.values()):
+        return report
+    for name, digest in sorted(backends.items()):
+        rate = None
+        for size in sizes:
+            # Padding, length and checksum blocks cost three compressions
+            compressions = size // 64 + 3
+            result = {"backend": name, "size": size}
+            if rate is not None and compressions / rate > budget:
+                result["skipped"] = True
+                report["results"].append(result)
+                continue
+            data = os.urandom(size)
+            repeat = 0
+            start = time.perf_counter()
+            while True:
+                digest(data, digest_size)
+                repeat += 1
+                elapsed = time.perf_counter() - start
+                if elapsed >= min_time:
+                    break
+            elapsed /= repeat
+            rate = compressions / elapsed
+            result.update({
+                "repeat": repeat,
+                "seconds": elapsed,
+                "mb_per_s": size / elapsed / 1e6,
+                "block_latency_us": elapsed / compressions * 1e6,
+            })
+            report["results"].append(result)
+    return report
+
+
+def bench_batch(counts=BATCH_COUNTS, size=256, digest_size=512, check=100):
+    """ Scaling of :func:`digest_many` with the number of messages
+
+    First ``check`` digests of every run are compared with the scalar
+    :class:`GOST341112` ones, scalar rate is measured on them too.
+    """
+    results = []
+    for count in counts:
+        messages = [os.urandom(size) for _ in range(count)]
+        start = time.perf_counter()
+        batch = digest_many(messages, digest_size)
+        elapsed = time.perf_counter() - start
+
+        sample = messages[:check]
+        start = time.perf_counter()
+        scalar = [GOST341112(m, digest_size).digest() for m in sample]
+        scalar_elapsed = time.perf_counter() - start
+        results.append({
+            "count": count,
+            "seconds": elapsed,
+            "messages_per_s": count / elapsed,
+            "mb_per_s": count * size / elapsed / 1e6,
+            "scalar_messages_per_s": len(sample) / scalar_elapsed,
+            "matches_scalar": batch[:check] == scalar,
+        })
+    return {
+        "benchmark": "streebog_batch",
+        "numpy": numpy.__version__ if numpy is not None else None,
+        "message_size": size,
+        "digest_size": digest_size,
+        "results": results,
+    }
+
+
+def _rate(func, min_time):
+    """ Calls per second of func, repeated for at least min_time seconds
+    """
+    repeat = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        repeat += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return repeat / elapsed
+
+
+def bench_der(curve_name=DEFAULT_CURVE, min_time=0.5):
+    """ SignatureSequence encode and decode rate, pyasn1 and der.py
+
+    Both encoders are fed the same signature, the fast one must give
+    the same bytes, and the fast decoder must get the same values back.
+    """
+    curve = GOST3410Curve(*CURVE_PARAMS[curve_name])
+    prv = private_key(curve)
+    pub = public_key(curve, prv)
+    signature = sign(curve, prv, os.urandom(curve.point_size))
+    meta = ("lorem.txt", 12345)
+
+    def pyasn1_encode():
+        return asn1_encoder.encode(signature_sequence(curve, pub, signature, *meta))
+
+    def fast_encode():
+        return encode_signature(curve, pub, signature, *meta)
+
+    encoded = pyasn1_encode()
+    decoded = decode_signature(encoded)
+    sign_p = asn1_decoder.decode(encoded, asn1Spec=SignatureSequence())[0].getComponentByName("sign")
+    return {
+        "benchmark": "signature_der",
+        "curve": curve_name,
+        "size": len(encoded),
+        "identical": fast_encode() == encoded,
+        "decoded_match": (
+            (decoded.r, decoded.s) == signature and decoded.pub == pub and
+            (int(sign_p.getComponentByName("r")), int(sign_p.getComponentByName("s"))) == signature
+        ),
+        "encode_per_s": {
+            "pyasn1": _rate(pyasn1_encode, min_time),
+            "fast": _rate(fast_encode, min_time),
+        },
+        "decode_per_s": {
+            "pyasn1": _rate(lambda: asn1_decoder.decode(encoded, asn1Spec=SignatureSequence()), min_time),
+            "fast": _rate(lambda: decode_signature(encoded), min_time),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    throughput = sub.add_parser("throughput", help="single message hashing rate")
+    throughput.add_argument("--digest-size", type=int, default=512, choices=(256, 512))
+    throughput.add_argument("--max-size", type=int, default=THROUGHPUT_SIZES[-1])
+    throughput.add_argument("--min-time", type=float, default=0.5,
+                            help="minimal seconds per measurement")
+    throughput.add_argument("--budget", type=float, default=60.0,
+                            help="skip sizes predicted to take longer, seconds")
+
+    batch = sub.add_parser("batch", help="digest_many() scaling")
+    batch.add_argument("--size", type=int, default=256, help="message size, bytes")
+    batch.add_argument("--digest-size", type=int, default=512, choices=(256, 512))
+    batch.add_argument("--max-count", type=int, default=BATCH_COUNTS[-1])
+
+    der = sub.add_parser("der", help="signature DER encode/decode rate")
+    der.add_argument("--curve", default=DEFAULT_CURVE, choices=sorted(CURVE_PARAMS))
+    der.add_argument("--min-time", type=float, default=0.5,
+                     help="minimal seconds per measurement")
+
+    args = parser.parse_args(argv)
+    if args.command == "throughput":
+        sizes = [size for size in THROUGHPUT_SIZES if size <= args.max_size]
+        report = bench_throughput(sizes, args.digest_size, args.min_time, args.budget)
+    elif args.command == "batch":
+        counts = [c for c in BATCH_COUNTS if c <= args.max_count]
+        report = bench_batch(counts, args.size, args.digest_size)
+    elif args.command == "der":
+        report = bench_der(args.curve, args.min_time)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+    if args.command == "throughput" and not report["results"]:
+        return 1
+    if args.command == "der" and not (report["identical"] and report["decoded_match"]):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,170 @@
-from binascii import hexlify
-from os.path import exists, basename
+import argparse
+import json
+import sys
+from binascii import hexlify, unhexlify
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from hashlib import md5
+from itertools import islice
+from mmap import mmap, ACCESS_READ
+from os import O_CREAT, O_TRUNC, O_WRONLY, cpu_count, fdopen, fstat, stat, walk
+from os import open as os_open
+from os.path import exists, basename, join, relpath
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import perf_counter
 
 from pyasn1.codec.der import encoder, decoder
 
+from . import der, manifest
+from .fileindex import FileIndex
 from .structs import SignatureSequence
 from .gost import gost341012
+from .gost.gost341112 import GOST341112, streebog256, streebog512
+
+# Hasher constructors for multi_digest
+DIGESTS = {
+    'md5': md5,
+    'streebog256': streebog256,
+    'streebog512': streebog512,
+}
+READ_CHUNK_SIZE = 1 << 20
+# Files up to this size are hashed from mmap, bigger ones are read by
+# a prefetching thread, so resident memory stays at a few chunks
+# (mapped pages are counted in RSS while they are cached)
+MMAP_MAX_SIZE = 64 << 20
+# File index of incremental tree runs, kept in the tree root
+INDEX_NAME = '.signindex'
+MANIFEST_SUFFIX = '.manifest'
 
 
 def md5sum(data):
-    from hashlib import md5
     m = md5()
     m.update(data)
     return m.digest()
 
 
 def gost34112012256(data):
-    from gost.gost341112 import GOST341112
     dgst = GOST341112(digest_size=256)
     dgst.update(data)
     return dgst.digest()
 
 
+def gost34112012512(data):
+    dgst = GOST341112(digest_size=512)
+    dgst.update(data)
+    return dgst.digest()
+
+
 default_dgstr = gost34112012256
 
+# Precomputed tables of signer public keys seen by verify_signature
+pubkey_cache = gost341012.PublicKeyCache()
+
+# Incremental hashers behind the digest functions, for chunked reading
+STREAMING_DGSTR = {
+    md5sum: md5,
+    gost34112012256: streebog256,
+    gost34112012512: streebog512,
+}
+
+
+def multi_digest(path, names=('streebog256', 'streebog512', 'md5'), chunk_size=READ_CHUNK_SIZE):
+    """
+    Hash file with several algorithms at once, reading it only one time
+    :param path: file to hash
+    :param names: algorithms, keys of DIGESTS
+    :param chunk_size: read buffer size, every hasher is fed from it
+    :return: dict of algorithm name to digest
+    """
+    for name in names:
+        if name not in DIGESTS:
+            raise ValueError('Unknown digest algorithm: {0}'.format(name))
+    hashers = [(name, DIGESTS[name]()) for name in names]
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, 'rb') as file:
+        while True:
+            size = file.readinto(buf)
+            if not size:
+                break
+            chunk = view[:size]
+            for _, hasher in hashers:
+                hasher.update(chunk)
+    return dict((name, hasher.digest()) for name, hasher in hashers)
+
+
+def prefetch_chunks(file, chunk_size=READ_CHUNK_SIZE):
+    """
+    Iterate over file chunks read by a background thread
+    Next chunk is read while the current one is processed, and no more
+    than two chunks are waiting, whatever the file size is.
+    """
+    chunks = Queue(maxsize=2)
+    stop = Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                chunk = file.read(chunk_size)
+                while not stop.is_set():
+                    try:
+                        chunks.put(chunk, timeout=0.1)
+                        break
+                    except Full:
+                        pass
+                if not chunk:
+                    return
+        except Exception as e:
+            chunks.put(e)
+
+    thread = Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        stop.set()
+        try:
+            while True:
+                chunks.get_nowait()
+        except Empty:
+            pass
+        thread.join()
+
+
+def file_digest(path, dgst_f=default_dgstr):
+    """
+    Hash file without loading it into memory
+    If dgst_f has an incremental hasher in STREAMING_DGSTR, files up to
+    MMAP_MAX_SIZE are fed to it straight from mmap memoryview, bigger
+    ones chunk by chunk from prefetch_chunks. Any other dgst_f gets the
+    file contents as bytes, as it may keep or concatenate its argument.
+    :return: digest and file size
+    """
+    with open(path, 'rb') as file:
+        size = fstat(file.fileno()).st_size
+        hasher = STREAMING_DGSTR.get(dgst_f)
+        if hasher is None:
+            return dgst_f(file.read()), size
+        dgst = hasher()
+        if size > MMAP_MAX_SIZE:
+            for chunk in prefetch_chunks(file):
+                dgst.update(chunk)
+        elif size:
+            with mmap(file.fileno(), 0, access=ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    dgst.update(view)
+                finally:
+                    view.release()
+        return dgst.digest(), size
+
 
 class CryptoError(Exception):
     """Base class for all exceptions in this module."""
@@ -40,14 +182,16 @@ class SigningError(CryptoError):
     """Raised when signature creation fails."""
 
 
-def create_signature(curve, prv, dgst, filename='', filesize=0):
-    signature = gost341012.sign(curve, prv, dgst, 2012)
-    pub = gost341012.public_key(curve, prv)
+def signature_sequence(curve, pub, signature, filename='', filesize=0):
+    """
+    Build pyasn1 SignatureSequence tree
+    der.encode_signature gives the same DER much faster.
+    """
     s = SignatureSequence()
 
     params = s.getComponentByName('params').getComponentByName('keydatasquence')
-    params.setComponentByName('text', 'gostSignKey')
-    params.setComponentByName('algo', b'80060700')
+    params.setComponentByName('text', der.KEY_TEXT)
+    params.setComponentByName('algo', der.KEY_ALGO)
     openkey = params.getComponentByName('open_key')
     openkey.setComponentByName('x', pub[0])
     openkey.setComponentByName('y', pub[1])
@@ -68,16 +212,42 @@ def create_signature(curve, prv, dgst, filename='', filesize=0):
     sign = s.getComponentByName('sign')
     sign.setComponentByName('r', signature[0])
     sign.setComponentByName('s', signature[1])
-    print('\tSIGN: {0}{1}({2} bits)'.format(str(signature[0]), str(signature[0]), signature[0].bit_length() + signature[1].bit_length()))
 
     metadata = s.getComponentByName('meta')
     metadata.setComponentByName('filename', filename)
     metadata.setComponentByName('filesize', filesize)
+    return s
+
+
+def create_signature(curve, prv, dgst, filename='', filesize=0):
+    signature = gost341012.sign(curve, prv, dgst, 2012)
+    print('\tSIGN: {0}{1}({2} bits)'.format(str(signature[0]), str(signature[0]), signature[0].bit_length() + signature[1].bit_length()))
     return signature[0], signature[1]
 
 
+def signature_der(curve, prv, dgst, filename='', filesize=0, pub=None):
+    """
+    Sign the digest and encode SignatureSequence of it
+    :param pub: public key of prv, computed if not given
+    :return: DER bytes
+    """
+    if pub is None:
+        pub = gost341012.public_key(curve, prv)
+    signature = gost341012.sign(curve, prv, dgst, 2012)
+    return der.encode_signature(curve, pub, signature, filename=filename, filesize=filesize)
+
+
+def read_signature(path):
+    """
+    Read .sign file
+    :return: der.SignatureFields
+    """
+    with open(path, 'rb') as sign_f:
+        return der.decode_signature(sign_f.read())
+
+
 def verify_signature(curve, s, dgst_f=default_dgstr, own_pubkey=None):
-    return gost341012.verify(curve, own_pubkey, dgst_f, s)
+    return gost341012.verify(curve, own_pubkey, dgst_f, s, cache=pubkey_cache)
     # try:
     #     params = s.getComponentByName('params').getComponentByName('keydatasquence')
 
@@ -117,11 +287,8 @@ def verify_signature(curve, s, dgst_f=default_dgstr, own_pubkey=None):
 
 
 def sign_file(path, curve, prv, dgst_f=default_dgstr):
-    with open(path, 'rb') as file:
-        data = file.read()
-        dgst = dgst_f(data)
-        return create_signature(curve, prv, dgst, filename=basename(path), filesize=len(data))
-    return None
+    dgst, filesize = file_digest(path, dgst_f)
+    return create_signature(curve, prv, dgst, filename=basename(path), filesize=filesize)
 
     # try:
     #     with open(path, 'rb') as file:
@@ -156,10 +323,8 @@ def verify_file(curve, filepath, sign=None, dgst_f=default_dgstr, own_pubkey=Non
     #         print(struct.prettyPrint())
     #         dgst = dgst_f(data)
     #         is_verified = verify_signature(dgst, struct, own_pubkey)
-    with open(filepath, 'rb') as file:
-        data = file.read()
-        dgst = dgst_f(data)
-        return verify_signature(curve, sign, dgst, own_pubkey)
+    dgst, _ = file_digest(filepath, dgst_f)
+    return verify_signature(curve, sign, dgst, own_pubkey)
 
     # except VerificationError:
     #     raise
@@ -171,11 +336,629 @@ def verify_file(curve, filepath, sign=None, dgst_f=default_dgstr, own_pubkey=Non
     #     return is_verified
 
 
+# Per process state of sign_many/verify_many workers
+_worker = {}
+
+
+def _init_worker(curve, prv, dgst_f):
+    curve.base_table()
+    curve.base_odd_multiples()
+    _worker['curve'] = curve
+    _worker['prv'] = prv
+    _worker['dgst_f'] = dgst_f
+
+
+def _job_digest(target):
+    if isinstance(target, (bytes, bytearray)):
+        return target
+    dgst, _ = file_digest(target, _worker['dgst_f'])
+    return dgst
+
+
+def _sign_jobs(targets):
+    curve, prv = _worker['curve'], _worker['prv']
+    return [(target, gost341012.sign(curve, prv, _job_digest(target))) for target in targets]
+
+
+def _verify_jobs(jobs):
+    curve = _worker['curve']
+    return [
+        (target, gost341012.verify(curve, pub, _job_digest(target), signature, cache=pubkey_cache))
+        for target, signature, pub in jobs
+    ]
+
+
+def _pool_map(func, jobs, curve, prv, dgst_f, workers, in_flight, chunk_size):
+    """
+    Run func over chunks of jobs in a process pool, yield results as they complete
+    Workers are set up by _init_worker, no more than in_flight jobs are
+    submitted at a time, so jobs may come from an endless generator.
+    """
+    workers = workers or cpu_count() or 1
+    in_flight = in_flight or workers * chunk_size * 4
+    jobs = iter(jobs)
+    pending = set()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(curve, prv, dgst_f)) as pool:
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) * chunk_size < in_flight:
+                    chunk = list(islice(jobs, chunk_size))
+                    if not chunk:
+                        exhausted = True
+                        break
+                    pending.add(pool.submit(func, chunk))
+                if not pending:
+                    return
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for result in future.result():
+                        yield result
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def sign_many(targets, curve, prv, dgst_f=default_dgstr, workers=None, in_flight=None, chunk_size=4):
+    """
+    Sign many files or digests in parallel processes
+    Every worker builds the curve tables once, when it starts.
+    :param targets: iterable of file paths or digests (bytes)
+    :param workers: number of processes, all CPUs by default
+    :param in_flight: most jobs submitted and not yet returned
+    :param chunk_size: jobs sent to a worker at once
+    :return: iterator of (target, (r, s)) in completion order
+    """
+    return _pool_map(_sign_jobs, targets, curve, prv, dgst_f, workers, in_flight, chunk_size)
+
+
+def verify_many(jobs, curve, dgst_f=default_dgstr, workers=None, in_flight=None, chunk_size=4):
+    """
+    Verify many files or digests in parallel processes
+    Workers keep their own precomputed tables of public keys.
+    :param jobs: iterable of (file path or digest, (r, s), public key)
+    :return: iterator of (target, bool) in completion order
+    """
+    return _pool_map(_verify_jobs, jobs, curve, None, dgst_f, workers, in_flight, chunk_size)
+
+
+def write_keys(path, curve, count, batch_size=1024):
+    """
+    Generate key pairs into a file, one "private public" line per pair
+    Keys are hex of gost341012.prv_marshal and pub_marshal. Lines are
+    written as pairs are generated, batch_size public keys at a time,
+    so memory use does not depend on count. A new file is readable by
+    the owner only, as it holds private keys.
+    :return: number of key pairs written
+    """
+    written = 0
+    with fdopen(os_open(path, O_WRONLY | O_CREAT | O_TRUNC, 0o600), 'w') as file:
+        for prv, pub in gost341012.generate_keys(curve, count, batch_size):
+            file.write('{0} {1}\n'.format(
+                hexlify(gost341012.prv_marshal(prv, curve)).decode('ascii'),
+                hexlify(gost341012.pub_marshal(pub, curve=curve)).decode('ascii'),
+            ))
+            written += 1
+    return written
+
+
+def read_pubkey(value, curve):
+    """
+    Read a public key given as hex of gost341012.pub_marshal, or as a
+    file holding it, as export-pubkey writes
+    """
+    if exists(value):
+        with open(value) as file:
+            value = file.read()
+    raw = unhexlify(value.strip())
+    if len(raw) != 2 * curve.point_size:
+        raise ValueError('Public key is not {0} bytes'.format(2 * curve.point_size))
+    return gost341012.pub_unmarshal(raw, curve=curve)
+
+
+def read_keys(path, curve):
+    """
+    Read key pairs written by write_keys
+    :return: iterator of (prv, pub)
+    """
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            prv, pub = line.split()
+            yield gost341012.prv_unmarshal(unhexlify(prv)), gost341012.pub_unmarshal(unhexlify(pub), curve=curve)
+
+
+class StageStats(object):
+    """
+    Counters of one pipeline stage
+    Input queue depth is sampled every time the stage takes an item: a
+    stage whose queue is always full is the bottleneck, stages after it
+    see empty queues.
+    """
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.bytes = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+        self.depth_max = 0
+        self.depth_sum = 0
+        self.depth_samples = 0
+        self._lock = Lock()
+
+    def take(self, depth):
+        with self._lock:
+            if self.started is None:
+                self.started = perf_counter()
+            self.depth_max = max(self.depth_max, depth)
+            self.depth_sum += depth
+            self.depth_samples += 1
+
+    def done(self, busy, size=0, error=False):
+        with self._lock:
+            self.items += 1
+            self.bytes += size
+            self.busy += busy
+            if error:
+                self.errors += 1
+            self.finished = perf_counter()
+
+    def report(self):
+        wall = (self.finished - self.started) if self.items else 0.0
+        return {
+            'workers': self.workers,
+            'items': self.items,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'wall_seconds': wall,
+            'busy_seconds': self.busy,
+            'items_per_s': self.items / wall if wall else None,
+            'mb_per_s': self.bytes / wall / 1e6 if wall else None,
+            # Share of time the stage workers were doing their job
+            'utilization': self.busy / wall / self.workers if wall else None,
+            'queue_depth_max': self.depth_max,
+            'queue_depth_mean': self.depth_sum / self.depth_samples if self.depth_samples else None,
+        }
+
+
+def _is_manifest(dirpath, filename, filenames):
+    """
+    Whether filename is a manifest sign_manifest wrote for a file next to it
+    """
+    if not filename.endswith(MANIFEST_SUFFIX) or filename[:-len(MANIFEST_SUFFIX)] not in filenames:
+        return False
+    try:
+        with open(join(dirpath, filename), 'rb') as manifest_f:
+            return manifest_f.read(len(manifest.MAGIC)) == manifest.MAGIC
+    except OSError:
+        return False
+
+
+def _walk_tree(root, suffix):
+    for dirpath, dirnames, filenames in walk(root):
+        dirnames.sort()
+        names = set(filenames)
+        for filename in sorted(filenames):
+            if filename.endswith(suffix) or filename.startswith(INDEX_NAME):
+                continue
+            if not _is_manifest(dirpath, filename, names):
+                yield join(dirpath, filename)
+
+
+def index_context(curve, dgst_f):
+    """
+    FileIndex context of digests made with dgst_f on the curve
+    """
+    name = '{0}.{1}'.format(dgst_f.__module__, dgst_f.__qualname__)
+    return md5(repr((name, tuple(curve))).encode('utf-8')).digest()
+
+
+def _prepare_index(index, curve, dgst_f):
+    context = index_context(curve, dgst_f)
+    if index.context != context:
+        index.reset(context)
+
+
+def _forget_missing(index, seen):
+    """
+    Drop index entries of files that are gone from the tree
+    """
+    for rel in index:
+        if rel not in seen:
+            index.remove(rel)
+    index.flush()
+
+
+def sign_tree(root, curve, prv, dgst_f=default_dgstr, hash_workers=4, hash_processes=0,
+              queue_size=64, write_batch=32, suffix='.sign', index=None):
+    """
+    Sign every file of a directory tree into a detached [file].sign
+    Stages run concurrently and are connected with bounded queues, so a
+    slow stage holds the ones before it back instead of piling work up:
+        walk -> hash (hash_workers threads) -> sign -> write
+    Hash threads hash files themselves, or hand them over to a pool of
+    hash_processes processes, as pure Python Streebog holds the GIL.
+    Signatures are SignatureSequence DER with meta filename/filesize,
+    the writer writes them write_batch files at a time.
+    With a FileIndex, files whose stat matches the index, or whose digest
+    does, and that have a .sign file are skipped before signing, if the
+    indexed signature is of the same key. An index of another curve or
+    digest function is reset.
+    :param FileIndex index: file states of the previous runs, updated
+    :return: dict with per stage statistics and failed paths
+    """
+    if hash_workers < 1:
+        raise ValueError('At least one hash worker is needed')
+    if queue_size < 1:
+        raise ValueError('Queues must be bounded, queue_size is at least 1')
+    pub = gost341012.public_key(curve, prv)
+    if index is not None:
+        _prepare_index(index, curve, dgst_f)
+    stages = OrderedDict((name, StageStats(name, workers)) for name, workers in (
+        ('walk', 1), ('hash', hash_workers), ('sign', 1), ('write', 1),
+    ))
+    paths = Queue(maxsize=queue_size)
+    digests = Queue(maxsize=queue_size)
+    signed = Queue(maxsize=queue_size)
+    failed = []
+    failed_lock = Lock()
+    hashers_left = [hash_workers]
+    unchanged = [0]
+    seen = set()
+    pool = ProcessPoolExecutor(hash_processes) if hash_processes else None
+
+    def fail(path, error):
+        with failed_lock:
+            failed.append((path, '{0}: {1}'.format(type(error).__name__, error)))
+
+    def skip():
+        with failed_lock:
+            unchanged[0] += 1
+
+    def signed_before(entry, rel, path):
+        if entry is None or entry.sig_offset < 0:
+            return False
+        signature = index.signature(rel)
+        try:
+            # A missing, damaged or replaced .sign is written again
+            with open(path + suffix, 'rb') as sign_f:
+                if signature is None or sign_f.read(len(signature) + 1) != signature:
+                    return False
+            return der.decode_signature(signature).pub == tuple(pub)
+        except (OSError, der.DERError):
+            return False
+
+    def walker():
+        stats = stages['walk']
+        try:
+            start = perf_counter()
+            for path in _walk_tree(root, suffix):
+                if index is not None:
+                    seen.add(relpath(path, root))
+                stats.take(0)
+                stats.done(perf_counter() - start)
+                paths.put(path)
+                start = perf_counter()
+        except Exception as e:
+            fail(root, e)
+        finally:
+            for _ in range(hash_workers):
+                paths.put(None)
+
+    def hasher():
+        stats = stages['hash']
+        try:
+            while True:
+                depth = paths.qsize()
+                path = paths.get()
+                if path is None:
+                    return
+                stats.take(depth)
+                start = perf_counter()
+                rel = st = None
+                try:
+                    if index is not None:
+                        # Stat before reading, a file changed while hashed
+                        # then mismatches on the next run
+                        rel, st = relpath(path, root), stat(path)
+                        if signed_before(index.unchanged(rel, st), rel, path):
+                            skip()
+                            stats.done(perf_counter() - start)
+                            continue
+                    if pool is not None:
+                        dgst, size = pool.submit(file_digest, path, dgst_f).result()
+                    else:
+                        dgst, size = file_digest(path, dgst_f)
+                except Exception as e:
+                    fail(path, e)
+                    stats.done(perf_counter() - start, error=True)
+                    continue
+                stats.done(perf_counter() - start, size)
+                if index is not None:
+                    entry = index.get(rel)
+                    if signed_before(entry, rel, path) and entry.digest == dgst:
+                        # Touched, but the same content
+                        index.update(rel, st, dgst)
+                        skip()
+                        continue
+                digests.put((path, dgst, size, rel, st))
+        finally:
+            with failed_lock:
+                hashers_left[0] -= 1
+                last = not hashers_left[0]
+            if last:
+                digests.put(None)
+
+    def signer():
+        stats = stages['sign']
+        try:
+            while True:
+                depth = digests.qsize()
+                item = digests.get()
+                if item is None:
+                    return
+                stats.take(depth)
+                path, dgst, size, rel, st = item
+                start = perf_counter()
+                try:
+                    signature = gost341012.sign(curve, prv, dgst)
+                    data = der.encode_signature(
+                        curve, pub, signature, filename=basename(path), filesize=size,
+                    )
+                except Exception as e:
+                    fail(path, e)
+                    stats.done(perf_counter() - start, error=True)
+                    continue
+                stats.done(perf_counter() - start)
+                signed.put((path + suffix, data, dgst, rel, st))
+        finally:
+            signed.put(None)
+
+    def writer():
+        stats = stages['write']
+        finished = False
+        while not finished:
+            depth = signed.qsize()
+            batch = [signed.get()]
+            while len(batch) < write_batch and batch[-1] is not None:
+                try:
+                    batch.append(signed.get_nowait())
+                except Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                finished = True
+            for sign_path, data, dgst, rel, st in batch:
+                stats.take(depth)
+                start = perf_counter()
+                try:
+                    with open(sign_path, 'wb') as sign_f:
+                        sign_f.write(data)
+                    if index is not None:
+                        index.update(rel, st, dgst, signature=data)
+                except Exception as e:
+                    fail(sign_path, e)
+                    stats.done(perf_counter() - start, error=True)
+                    continue
+                stats.done(perf_counter() - start, len(data))
+
+    threads = [Thread(target=walker, name='walk')]
+    threads += [Thread(target=hasher, name='hash-{0}'.format(i)) for i in range(hash_workers)]
+    threads += [Thread(target=signer, name='sign'), Thread(target=writer, name='write')]
+    start = perf_counter()
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if index is not None:
+        _forget_missing(index, seen)
+    return {
+        'root': root,
+        'seconds': perf_counter() - start,
+        'signed': stages['write'].items - stages['write'].errors,
+        'unchanged': unchanged[0],
+        'failed': failed,
+        'stages': OrderedDict((name, stats.report()) for name, stats in stages.items()),
+    }
+
+
+def verify_tree(root, curve, pub=None, dgst_f=default_dgstr, suffix='.sign', index=None):
+    """
+    Verify every file of a directory tree against its [file].sign
+    With a FileIndex, files whose stat matches the index are not hashed,
+    their indexed digest is checked against the signature instead. An
+    index of another curve or digest function is reset.
+    :param pub: expected signer public key, any one is accepted if None,
+                the report tells whether it was pinned
+    :param FileIndex index: file states of the previous runs, updated
+    :return: dict with counts and failed paths
+    """
+    start = perf_counter()
+    if index is not None:
+        _prepare_index(index, curve, dgst_f)
+    failed = []
+    verified = unchanged = 0
+    seen = set()
+    for path in _walk_tree(root, suffix):
+        rel = relpath(path, root)
+        seen.add(rel)
+        try:
+            with open(path + suffix, 'rb') as sign_f:
+                data = sign_f.read()
+            fields = der.decode_signature(data)
+            if (fields.p, fields.q, fields.a, fields.b, fields.x, fields.y) != \
+                    (curve.p, curve.q, curve.a, curve.b, curve.x, curve.y):
+                raise VerificationError('Signed on another curve')
+            if pub is not None and fields.pub != tuple(pub):
+                raise VerificationError('Signed with another key')
+            entry = None
+            if index is not None:
+                st = stat(path)
+                entry = index.unchanged(rel, st)
+            if entry is not None:
+                dgst = entry.digest
+                unchanged += 1
+            else:
+                dgst, _ = file_digest(path, dgst_f)
+            valid = gost341012.verify(curve, fields.pub, dgst, (fields.r, fields.s), cache=pubkey_cache)
+            if index is not None and entry is None:
+                # Keep a valid signature, so sign_tree can skip the file
+                index.update(rel, st, dgst, signature=data if valid else None)
+            if not valid:
+                raise VerificationError('Bad signature')
+        except Exception as e:
+            failed.append((path, '{0}: {1}'.format(type(e).__name__, e)))
+            continue
+        verified += 1
+    if index is not None:
+        _forget_missing(index, seen)
+    return {
+        'root': root,
+        'seconds': perf_counter() - start,
+        'pinned': pub is not None,
+        'verified': verified,
+        'unchanged': unchanged,
+        'failed': failed,
+    }
+
+
+def _positive(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('{0} is not a positive number'.format(value))
+    return number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='GOST R 34.10-2012 file signing')
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    tree = sub.add_parser('sign-tree', help='sign every file of a directory tree')
+    tree.add_argument('root')
+    tree.add_argument('--keys', required=True, help='key pairs file, as genkeys_bulk writes')
+    tree.add_argument('--key-index', type=int, default=0, help='line of the key pair to use')
+    tree.add_argument('--curve', default=gost341012.DEFAULT_CURVE, choices=sorted(gost341012.CURVE_PARAMS))
+    tree.add_argument('--digest', default='streebog256', choices=('streebog256', 'streebog512'))
+    tree.add_argument('--hash-workers', type=_positive, default=4)
+    tree.add_argument('--hash-processes', type=int, default=0,
+                      help='hash in that many processes, threads only by default')
+    tree.add_argument('--queue-size', type=_positive, default=64)
+    tree.add_argument('--write-batch', type=int, default=32)
+    tree.add_argument('--incremental', action='store_true',
+                      help='skip files unchanged since the last run, as {0} in the root records'.format(INDEX_NAME))
+
+    check = sub.add_parser('verify-tree', help='verify every file of a directory tree')
+    check.add_argument('root')
+    check.add_argument('--pubkey', help='signer public key, hex or a file, as export-pubkey writes')
+    check.add_argument('--keys', help='key pairs file, files must be signed with its key')
+    check.add_argument('--key-index', type=int, default=0, help='line of the key pair to use')
+    check.add_argument('--any-key', action='store_true',
+                       help='accept signatures of any key, nothing is verified against a pinned signer')
+    check.add_argument('--curve', default=gost341012.DEFAULT_CURVE, choices=sorted(gost341012.CURVE_PARAMS))
+    check.add_argument('--digest', default='streebog256', choices=('streebog256', 'streebog512'))
+    check.add_argument('--incremental', action='store_true',
+                       help='do not hash files unchanged since the last run')
+
+    export = sub.add_parser('export-pubkey', help='print a public key for --pubkey of verifiers')
+    export.add_argument('--keys', required=True, help='key pairs file, as genkeys_bulk writes')
+    export.add_argument('--key-index', type=int, default=0, help='line of the key pair to use')
+    export.add_argument('--curve', default=gost341012.DEFAULT_CURVE, choices=sorted(gost341012.CURVE_PARAMS))
+
+    chunked = sub.add_parser('sign-manifest', help='sign a big file as a manifest of chunk digests')
+    chunked.add_argument('file')
+    chunked.add_argument('--keys', required=True, help='key pairs file, as genkeys_bulk writes')
+    chunked.add_argument('--key-index', type=int, default=0, help='line of the key pair to use')
+    chunked.add_argument('--curve', default=gost341012.DEFAULT_CURVE, choices=sorted(gost341012.CURVE_PARAMS))
+    chunked.add_argument('--digest', default='streebog256', choices=('streebog256', 'streebog512'))
+    chunked.add_argument('--chunk-size', type=_positive, default=manifest.CHUNK_SIZE)
+    chunked.add_argument('--workers', type=_positive, help='hash processes, all CPUs by default')
+
+    partial = sub.add_parser('verify-manifest', help='verify chunks of a file signed with sign-manifest')
+    partial.add_argument('file')
+    partial.add_argument('--pubkey', help='signer public key, hex or a file, as export-pubkey writes')
+    partial.add_argument('--keys', help='key pairs file, the file must be signed with its key')
+    partial.add_argument('--key-index', type=int, default=0, help='line of the key pair to use')
+    partial.add_argument('--any-key', action='store_true',
+                         help='accept a manifest of any key, nothing is verified against a pinned signer')
+    partial.add_argument('--curve', default=gost341012.DEFAULT_CURVE, choices=sorted(gost341012.CURVE_PARAMS))
+    partial.add_argument('--first', type=int, default=0, help='first chunk to check')
+    partial.add_argument('--last', type=int, help='last chunk to check, included, the last one by default')
+    partial.add_argument('--workers', type=_positive, help='hash processes, all CPUs by default')
+
+    args = parser.parse_args(argv)
+    curve = gost341012.GOST3410Curve(*gost341012.CURVE_PARAMS[args.curve])
+    prv = pub = None
+    if args.keys:
+        if args.key_index < 0:
+            parser.error('argument --key-index: {0} is negative'.format(args.key_index))
+        try:
+            prv, pub = next(islice(read_keys(args.keys, curve), args.key_index, None))
+        except StopIteration:
+            parser.error('No key pair {0} in {1}'.format(args.key_index, args.keys))
+    if args.command == 'export-pubkey':
+        sys.stdout.write(hexlify(gost341012.pub_marshal(pub, curve=curve)).decode('ascii') + '\n')
+        return 0
+    if args.command in ('verify-tree', 'verify-manifest'):
+        if args.pubkey:
+            try:
+                pub = read_pubkey(args.pubkey, curve)
+            except ValueError as e:
+                parser.error('Bad public key: {0}'.format(e))
+        elif pub is None and not args.any_key:
+            parser.error('the signer is not pinned, give --pubkey or --keys, or --any-key')
+    if args.command == 'verify-manifest':
+        try:
+            with open(args.file + MANIFEST_SUFFIX, 'rb') as manifest_f:
+                signed = manifest.read_manifest(manifest_f.read())
+            check = manifest.verify_manifest(
+                args.file, signed, curve, pub, first=args.first, last=args.last,
+                workers=args.workers, cache=pubkey_cache,
+            )
+        except manifest.ManifestError as e:
+            parser.error(str(e))
+        report = check._asdict()
+        report['pinned'] = pub is not None
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+        # A grown or truncated file fails even if the checked chunks match
+        return 0 if check.signature and check.size and not check.failed else 1
+    dgst_f = {'streebog256': gost34112012256, 'streebog512': gost34112012512}[args.digest]
+    if args.command == 'sign-manifest':
+        data = manifest.sign_manifest(
+            args.file, curve, prv, chunk_size=args.chunk_size,
+            digest_size=len(dgst_f(b'')), workers=args.workers, pub=pub,
+        )
+        with open(args.file + MANIFEST_SUFFIX, 'wb') as manifest_f:
+            manifest_f.write(data)
+        return 0
+    index = FileIndex(join(args.root, INDEX_NAME)) if args.incremental else None
+    try:
+        if args.command == 'sign-tree':
+            report = sign_tree(
+                args.root, curve, prv, dgst_f,
+                hash_workers=args.hash_workers, hash_processes=args.hash_processes,
+                queue_size=args.queue_size, write_batch=args.write_batch, index=index,
+            )
+        else:
+            report = verify_tree(args.root, curve, pub, dgst_f, index=index)
+    finally:
+        if index is not None:
+            index.close()
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 1 if report['failed'] else 0
+
+
 if __name__ == '__main__':
-    from os import urandom
-    curve_params = gost341012.CURVE_PARAMS["GostR3410_2012_TC26_ParamSetA"]
-    curve = gost341012.GOST3410Curve(*curve_params)
-    prv_raw = urandom(32)
-    prv = gost341012.prv_unmarshal(prv_raw)
-    sign_file('./testdata/lorem.txt', curve, prv)
-    assert verify_file('./testdata/lorem.txt')
+    sys.exit(main())
@@ -0,0 +1,193 @@
+"""
+Fast DER codec for SignatureSequence from structs.py
+Output is byte-identical to pyasn1 encoder.encode of the same tree.
+The params set, which holds the curve and the public key, never changes
+for a key, so it is encoded once and cached, every signature only adds
+r, s and the file meta fields. Decoding walks the TLVs of a memoryview
+and builds no pyasn1 objects.
+"""
+
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+TAG_INTEGER = 0x02
+TAG_OCTET_STRING = 0x04
+TAG_UTF8_STRING = 0x0c
+TAG_SEQUENCE = 0x30
+TAG_SET = 0x31
+
+KEY_TEXT = 'gostSignKey'
+KEY_ALGO = b'80060700'
+
+PREFIX_CACHE_SIZE = 256
+
+SignatureFields = namedtuple('SignatureFields', (
+    'text', 'algo', 'pub', 'p', 'q', 'a', 'b', 'x', 'y', 'r', 's', 'filesize', 'filename',
+))
+
+
+class DERError(ValueError):
+    """Raised on malformed or unexpected DER input."""
+
+
+def _length(size):
+    if size < 0x80:
+        return bytes((size,))
+    raw = size.to_bytes((size.bit_length() + 7) // 8, 'big')
+    return bytes((0x80 | len(raw),)) + raw
+
+
+def _tlv(tag, content):
+    return bytes((tag,)) + _length(len(content)) + content
+
+
+def _integer(value):
+    value = int(value)
+    # Two's complement with room for the sign bit, -2^(8k-1) values get
+    # an extra 0xff byte, as pyasn1 gives them
+    size = value.bit_length() // 8 + 1
+    return _tlv(TAG_INTEGER, value.to_bytes(size, 'big', signed=True))
+
+
+def _utf8(value):
+    return _tlv(TAG_UTF8_STRING, value.encode('utf-8'))
+
+
+def encode_params(curve, pub, text=KEY_TEXT, algo=KEY_ALGO):
+    """
+    Encode the params set of the signature
+    :return: DER of KeyDataSet
+    """
+    keydata = b''.join((
+        _utf8(text),
+        _tlv(TAG_OCTET_STRING, bytes(algo)),
+        _tlv(TAG_SEQUENCE, _integer(pub[0]) + _integer(pub[1])),
+        _tlv(TAG_SEQUENCE, _integer(curve.p)),
+        _tlv(TAG_SEQUENCE, _integer(curve.a) + _integer(curve.b)),
+        _tlv(TAG_SEQUENCE, _integer(curve.x) + _integer(curve.y)),
+        _integer(curve.q),
+    ))
+    return _tlv(TAG_SET, _tlv(TAG_SEQUENCE, keydata))
+
+
+_prefixes = OrderedDict()
+_prefixes_lock = Lock()
+
+
+def params_prefix(curve, pub):
+    """
+    Get encode_params(curve, pub), caching PREFIX_CACHE_SIZE least
+    recently used keys
+    """
+    key = (tuple(curve), pub[0], pub[1])
+    with _prefixes_lock:
+        prefix = _prefixes.get(key)
+        if prefix is not None:
+            _prefixes.move_to_end(key)
+            return prefix
+    prefix = encode_params(curve, pub)
+    with _prefixes_lock:
+        _prefixes[key] = prefix
+        while len(_prefixes) > PREFIX_CACHE_SIZE:
+            _prefixes.popitem(last=False)
+    return prefix
+
+
+def encode_signature(curve, pub, signature, filename='', filesize=0):
+    """
+    Encode SignatureSequence
+    :param signature: r, s
+    :return: DER bytes, same as pyasn1 encoder.encode gives
+    """
+    r, s = signature
+    content = b''.join((
+        params_prefix(curve, pub),
+        _tlv(TAG_SEQUENCE, _integer(r) + _integer(s)),
+        _tlv(TAG_SEQUENCE, _integer(filesize) + _utf8(filename)),
+    ))
+    return _tlv(TAG_SEQUENCE, content)
+
+
+def _read(view, offset, end, tag):
+    """
+    Read TLV with the expected tag at offset
+    :return: content start and end offsets
+    """
+    if offset + 2 > end or view[offset] != tag:
+        raise DERError('Expected tag 0x{0:02x} at {1}'.format(tag, offset))
+    size = view[offset + 1]
+    offset += 2
+    if size & 0x80:
+        count = size & 0x7f
+        if not count or offset + count > end:
+            raise DERError('Bad length at {0}'.format(offset - 1))
+        size = int.from_bytes(view[offset:offset + count], 'big')
+        offset += count
+    if offset + size > end:
+        raise DERError('Truncated value at {0}'.format(offset))
+    return offset, offset + size
+
+
+def _read_integer(view, offset, end):
+    start, stop = _read(view, offset, end, TAG_INTEGER)
+    if start == stop:
+        raise DERError('Empty integer at {0}'.format(offset))
+    return int.from_bytes(view[start:stop], 'big', signed=True), stop
+
+
+def _read_string(view, offset, end, tag):
+    start, stop = _read(view, offset, end, tag)
+    return bytes(view[start:stop]), stop
+
+
+def decode_signature(data):
+    """
+    Decode SignatureSequence DER
+    :param data: bytes-like object
+    :return: SignatureFields
+    """
+    view = memoryview(data)
+    try:
+        start, end = _read(view, 0, len(view), TAG_SEQUENCE)
+        if end != len(view):
+            raise DERError('Trailing data after signature')
+        params, params_end = _read(view, start, end, TAG_SET)
+        offset, keydata_end = _read(view, params, params_end, TAG_SEQUENCE)
+        text, offset = _read_string(view, offset, keydata_end, TAG_UTF8_STRING)
+        algo, offset = _read_string(view, offset, keydata_end, TAG_OCTET_STRING)
+        ints = []
+        for count in (2, 1, 2, 2):
+            offset, seq_end = _read(view, offset, keydata_end, TAG_SEQUENCE)
+            for _ in range(count):
+                value, offset = _read_integer(view, offset, seq_end)
+                ints.append(value)
+        q, offset = _read_integer(view, offset, keydata_end)
+        if offset != keydata_end or keydata_end != params_end:
+            raise DERError('Unexpected data in params')
+        offset, seq_end = _read(view, params_end, end, TAG_SEQUENCE)
+        r, offset = _read_integer(view, offset, seq_end)
+        s, offset = _read_integer(view, offset, seq_end)
+        if offset != seq_end:
+            raise DERError('Unexpected data in sign')
+        offset, seq_end = _read(view, seq_end, end, TAG_SEQUENCE)
+        filesize, offset = _read_integer(view, offset, seq_end)
+        filename, offset = _read_string(view, offset, seq_end, TAG_UTF8_STRING)
+        if offset != seq_end or seq_end != end:
+            raise DERError('Unexpected data in meta')
+        return SignatureFields(
+            text=text.decode('utf-8'),
+            algo=algo,
+            pub=(ints[0], ints[1]),
+            p=ints[2],
+            q=q,
+            a=ints[3],
+            b=ints[4],
+            x=ints[5],
+            y=ints[6],
+            r=r,
+            s=s,
+            filesize=filesize,
+            filename=filename.decode('utf-8'),
+        )
+    finally:
+        view.release()
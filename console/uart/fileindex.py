@@ -0,0 +1,244 @@
+"""
+Persistent file-state index for incremental signing
+Maps a path to (size, mtime_ns, inode, digest, signature offset), so
+files whose stat did not change since the last run are neither hashed
+nor signed again. Both files of the index are append-only:
+    [index]                  header and records, the last record of a
+                             path wins
+    [index].[generation].sigs  DER signatures, records point into it
+Header context tells what made the digests, an index of another context
+is reset before use. Whole index is read into a dict on open, lookups
+and updates do not touch the disk besides appending a record. Stale records and signatures
+are dropped by compact(), run on close when they outnumber live ones.
+Compaction writes the next generation of both files, and atomic rename
+of the index switches to it.
+"""
+
+from collections import namedtuple
+from os import fsync, remove, replace
+from os.path import exists
+from struct import Struct
+from threading import Lock
+
+MAGIC = b'SIGIDX2\n'
+CONTEXT_SIZE = 16
+# magic, signatures file generation, context
+HEADER = Struct('<8sQ{0}s'.format(CONTEXT_SIZE))
+# path length, size, mtime_ns, inode, signature offset and length,
+# digest length, flags
+RECORD = Struct('<HQqQqIBB')
+FLAG_REMOVED = 1
+# compact() on close if there are that many more records than entries
+COMPACT_SLACK = 1024
+
+IndexEntry = namedtuple('IndexEntry', ('size', 'mtime_ns', 'inode', 'digest', 'sig_offset', 'sig_len'))
+
+
+def _pack(path, entry, flags=0):
+    raw = path.encode('utf-8', 'surrogateescape')
+    return RECORD.pack(
+        len(raw), entry.size, entry.mtime_ns, entry.inode,
+        entry.sig_offset, entry.sig_len, len(entry.digest), flags,
+    ) + raw + entry.digest
+
+
+class FileIndexError(ValueError):
+    """Raised on a file that is not an index."""
+
+
+class FileIndex(object):
+    """
+    Append-only path -> IndexEntry map persisted in a file
+    Updates are buffered, flush() or close() writes them out. All methods
+    are thread safe.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = 0
+        self.context = bytes(CONTEXT_SIZE)
+        self._entries = {}
+        self._records = 0
+        self._lock = Lock()
+        self._load()
+        self._log = open(self.path, 'ab')
+        self._sigs = open(self._sigs_path(self.generation), 'a+b')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return path in self._entries
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries))
+
+    def _sigs_path(self, generation):
+        return '{0}.{1}.sigs'.format(self.path, generation)
+
+    def _load(self):
+        if not exists(self.path):
+            with open(self.path, 'wb') as log:
+                log.write(HEADER.pack(MAGIC, self.generation, self.context))
+            return
+        with open(self.path, 'rb') as log:
+            data = log.read()
+        if len(data) < HEADER.size or HEADER.unpack_from(data)[0] != MAGIC:
+            raise FileIndexError('Not a file index: {0}'.format(self.path))
+        _, self.generation, self.context = HEADER.unpack_from(data)
+        # Plain tuples of IndexEntry fields, namedtuple creation would
+        # double the load time of big indexes
+        entries = self._entries
+        offset = HEADER.size
+        size = RECORD.size
+        total = len(data)
+        unpack_from = RECORD.unpack_from
+        records = 0
+        while offset + size <= total:
+            path_len, fsize, mtime_ns, inode, sig_offset, sig_len, digest_len, flags = unpack_from(data, offset)
+            start = offset + size
+            middle = start + path_len
+            end = middle + digest_len
+            if end > total:
+                break
+            path = data[start:middle].decode('utf-8', 'surrogateescape')
+            if flags & FLAG_REMOVED:
+                entries.pop(path, None)
+            else:
+                entries[path] = (fsize, mtime_ns, inode, data[middle:end], sig_offset, sig_len)
+            records += 1
+            offset = end
+        self._records = records
+        if offset != total:
+            # Torn last record of an interrupted run
+            with open(self.path, 'r+b') as log:
+                log.truncate(offset)
+
+    def _append(self, path, entry, flags=0):
+        self._log.write(_pack(path, entry, flags))
+        self._records += 1
+
+    def get(self, path):
+        entry = self._entries.get(path)
+        return None if entry is None else IndexEntry._make(entry)
+
+    def unchanged(self, path, st):
+        """
+        Get the entry if size, mtime and inode of stat result st match it
+        """
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        if entry[0] != st.st_size or entry[1] != st.st_mtime_ns or entry[2] != st.st_ino:
+            return None
+        return IndexEntry._make(entry)
+
+    def update(self, path, st, digest, signature=None):
+        """
+        Record stat result st and digest of the path
+        :param bytes signature: new signature to store, the previous one
+                                is kept if not given
+        """
+        with self._lock:
+            old = self.get(path)
+            if signature is not None:
+                self._sigs.seek(0, 2)
+                sig_offset = self._sigs.tell()
+                self._sigs.write(signature)
+                sig_len = len(signature)
+            elif old is not None and old.digest == digest:
+                sig_offset, sig_len = old.sig_offset, old.sig_len
+            else:
+                sig_offset, sig_len = -1, 0
+            entry = IndexEntry(st.st_size, st.st_mtime_ns, st.st_ino, bytes(digest), sig_offset, sig_len)
+            self._entries[path] = entry
+            self._append(path, entry)
+            return entry
+
+    def remove(self, path):
+        with self._lock:
+            if self._entries.pop(path, None) is not None:
+                self._append(path, IndexEntry(0, 0, 0, b'', -1, 0), FLAG_REMOVED)
+
+    def signature(self, path):
+        """
+        Stored signature of the path, None if there is none
+        """
+        entry = self.get(path)
+        if entry is None or entry.sig_offset < 0:
+            return None
+        with self._lock:
+            self._sigs.flush()
+            self._sigs.seek(entry.sig_offset)
+            signature = self._sigs.read(entry.sig_len)
+        # Log records may outlive signatures lost in a crash
+        return signature if len(signature) == entry.sig_len else None
+
+    def flush(self):
+        with self._lock:
+            self._sigs.flush()
+            self._log.flush()
+
+    def compact(self):
+        """
+        Rewrite both files with live entries only
+        """
+        with self._lock:
+            self._sigs.flush()
+            self._log.flush()
+            generation = self.generation + 1
+            with open(self.path + '.tmp', 'wb') as log, open(self._sigs_path(generation), 'wb') as sigs:
+                log.write(HEADER.pack(MAGIC, generation, self.context))
+                entries = {}
+                for path, entry in self._entries.items():
+                    entry = IndexEntry._make(entry)
+                    if entry.sig_offset >= 0:
+                        self._sigs.seek(entry.sig_offset)
+                        signature = self._sigs.read(entry.sig_len)
+                        if len(signature) == entry.sig_len:
+                            entry = entry._replace(sig_offset=sigs.tell())
+                            sigs.write(signature)
+                        else:
+                            entry = entry._replace(sig_offset=-1, sig_len=0)
+                    log.write(_pack(path, entry))
+                    entries[path] = entry
+                for file in (log, sigs):
+                    file.flush()
+                    fsync(file.fileno())
+            self._log.close()
+            self._sigs.close()
+            replace(self.path + '.tmp', self.path)
+            remove(self._sigs_path(self.generation))
+            self.generation = generation
+            self._entries = entries
+            self._records = len(entries)
+            self._log = open(self.path, 'ab')
+            self._sigs = open(self._sigs_path(generation), 'a+b')
+
+    def reset(self, context):
+        """
+        Drop all entries and switch to the context
+        :param bytes context: up to CONTEXT_SIZE bytes, zero padded
+        """
+        if len(context) > CONTEXT_SIZE:
+            raise ValueError('Context is longer than {0} bytes'.format(CONTEXT_SIZE))
+        with self._lock:
+            self._entries.clear()
+            self.context = bytes(context).ljust(CONTEXT_SIZE, b'\0')
+        self.compact()
+
+    def close(self):
+        if self._log.closed:
+            return
+        if self._records > 2 * len(self._entries) + COMPACT_SLACK:
+            self.compact()
+        with self._lock:
+            self._sigs.close()
+            self._log.close()
@@ -0,0 +1,105 @@
+# coding: utf-8
+""" Prime field arithmetic for elliptic curves
+Curve formulas only need a reduction of products and sums modulo p.
+Special form primes p = 2^k - c with small c, like both TC26 512-bit
+parameter sets have, are reduced with shift-and-add folding instead of
+a generic bigint division. Smaller primes, like the 256-bit sets have,
+stay with the division, which beats folding at that size.
+"""
+
+from .utils import modinvert
+from .utils import modinvert_many
+
+
+# Folding pays off only while c fits into a couple of machine words
+FOLD_MAX_BITS = 64
+# and p is big enough: reducing 2k-bit products folds slower than
+# bigint remainder below about 384 bits, at 256 bits by about 20%
+FOLD_MIN_BITS = 384
+
+
+class PrimeField(object):
+    """ Integers modulo prime p with generic reduction
+
+    Reduction is CPython's own bigint remainder: Barrett reduction
+    written in Python loses to it, as every step is a bigint operation
+    interpreted separately.
+    """
+    special = False
+
+    def __init__(self, p):
+        self.p = p
+
+    def __repr__(self):
+        return "%s(0x%x)" % (self.__class__.__name__, self.p)
+
+    def red(self, x):
+        """ x mod p, for any integer x, including negative ones
+        """
+        return x % self.p
+
+    def inv(self, x):
+        """ Multiplicative inverse of x modulo p
+        """
+        return modinvert(self.red(x), self.p)
+
+    def inv_many(self, values):
+        """ Inverses of many nonzero numbers modulo p, with one inversion
+        """
+        return modinvert_many([self.red(x) for x in values], self.p)
+
+
+class PseudoMersenneField(PrimeField):
+    """ Integers modulo prime p = 2^k - c with small, possibly negative, c
+
+    As 2^k = c (mod p), x = hi * 2^k + lo folds into hi * c + lo, every
+    fold shortening x by about k - bits(c) bits. A product of two reduced
+    numbers takes two folds, then at most a couple of corrections by p.
+
+    >>> f = PseudoMersenneField(2 ** 511 + 111, 511, -111)
+    >>> f.red(-5) == 2 ** 511 + 106
+    True
+    """
+    special = True
+
+    def __init__(self, p, k, c):
+        if p != (1 << k) - c:
+            raise ValueError("p is not 2^k - c")
+        if c.bit_length() >= k - 1:
+            raise ValueError("c is too large to fold")
+        super(PseudoMersenneField, self).__init__(p)
+        self.k = k
+        self.c = c
+        self.mask = (1 << k) - 1
+
+    def red(self, x):
+        k = self.k
+        c = self.c
+        mask = self.mask
+        hi = x >> k
+        # Fold until -2^k <= x < 2^k, negative c makes the sign alternate
+        while hi and hi != -1:
+            x = (x & mask) + hi * c
+            hi = x >> k
+        p = self.p
+        while x < 0:
+            x += p
+        while x >= p:
+            x -= p
+        return x
+
+
+def prime_field(p):
+    """ Field for the prime, with the fastest available reduction
+
+    :param long p: field characteristic
+    :rtype: PrimeField
+    """
+    k = p.bit_length()
+    if k < FOLD_MIN_BITS:
+        return PrimeField(p)
+    # p just below 2^k or just above 2^(k-1)
+    for k, c in ((k, (1 << k) - p), (k - 1, (1 << (k - 1)) - p)):
+        if abs(c).bit_length() <= min(FOLD_MAX_BITS, k // 2):
+            return PseudoMersenneField(p, k, c)
+    return PrimeField(p)
@@ -20,12 +20,21 @@ This is implementation of GOST R 34.10-2001 (:rfc:`5832`), GOST R
 hash function and corresponding digest and signature lengths.
 """
 
+from collections import Counter
+from collections import OrderedDict
+from collections import deque
+from itertools import islice
 from os import urandom
+from sys import getsizeof
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import time
 
+from .field import prime_field
 from .utils import bytes2long
 from .utils import hexdec
 from .utils import long2bytes
-from .utils import modinvert
 
 
 MODE2SIZE = {
@@ -35,7 +44,8 @@ MODE2SIZE = {
 
 
 DEFAULT_CURVE = "GostR3410_2012_TC26_ParamSetA"
-# Curve parameters are the following: p, q, a, b, x, y
+# Curve parameters are the following: p, q, a, b, x, y, followed by
+# e, d of the twisted Edwards form for the curves that have it
 CURVE_PARAMS_TEXT = {
     # Curve params truncated, only params defined in GOSTR3410_2012 whitepaper here.
     # For more curve params visit http://git.cypherpunks.ru/cgit.cgi/pygost.git/tree/pygost/gost3410.py#n121
@@ -55,6 +65,44 @@ CURVE_PARAMS_TEXT = {
         "00000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000002",
         "1A8F7EDA389B094C2C071E3647A8940F3C123B697578C213BE6DD9E6C8EC7335DCB228FD1EDF4A39152CBCAAF8C0398828041055F94CEEEC7E21340780FE41BD"
     ),
+    # id-tc26-gost-3410-12-256-paramSetA, :rfc:`7836`
+    "GostR3410_2012_TC26_256_ParamSetA": (
+        "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFD97",
+        "400000000000000000000000000000000FD8CDDFC87B6635C115AF556C360C67",
+        "C2173F1513981673AF4892C23035A27CE25E2013BF95AA33B22C656F277E7335",
+        "295F9BAE7428ED9CCC20E7C359A9D41A22FCCD9108E17BF7BA9337A6F8AE9513",
+        "91E38443A5E82C0D880923425712B2BB658B9196932E02C78B2582FE742DAA28",
+        "32879423AB1A0375895786C4BB46E9565FDE0B5344766740AF268ADB32322E5C",
+        "0000000000000000000000000000000000000000000000000000000000000001",
+        "0605F6B7C183FA81578BC39CFAD518132B9DF62897009AF7E522C32D6DC7BFFB",
+    ),
+    # id-tc26-gost-3410-12-256-paramSetB, same as id-GostR3410-2001-CryptoPro-A-ParamSet
+    "GostR3410_2012_TC26_256_ParamSetB": (
+        "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFD97",
+        "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF6C611070995AD10045841B09B761B893",
+        "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFD94",
+        "00000000000000000000000000000000000000000000000000000000000000A6",
+        "0000000000000000000000000000000000000000000000000000000000000001",
+        "8D91E471E0989CDA27DF505A453F2B7635294F2DDF23E3B122ACC99C9E9F1E14",
+    ),
+    # id-tc26-gost-3410-12-256-paramSetC, same as id-GostR3410-2001-CryptoPro-B-ParamSet
+    "GostR3410_2012_TC26_256_ParamSetC": (
+        "8000000000000000000000000000000000000000000000000000000000000C99",
+        "800000000000000000000000000000015F700CFFF1A624E5E497161BCC8A198F",
+        "8000000000000000000000000000000000000000000000000000000000000C96",
+        "3E1AF419A269A5F866A7D3C25C3DF80AE979259373FF2B182F49D4CE7E1BBC8B",
+        "0000000000000000000000000000000000000000000000000000000000000001",
+        "3FA8124359F96680B83D1C3EB2C070E5C545C9858D03ECFB744BF8D717717EFC",
+    ),
+    # id-tc26-gost-3410-12-256-paramSetD, same as id-GostR3410-2001-CryptoPro-C-ParamSet
+    "GostR3410_2012_TC26_256_ParamSetD": (
+        "9B9F605F5A858107AB1EC85E6B41C8AACF846E86789051D37998F7B9022D759B",
+        "9B9F605F5A858107AB1EC85E6B41C8AA582CA3511EDDFB74F02F3A6598980BB9",
+        "9B9F605F5A858107AB1EC85E6B41C8AACF846E86789051D37998F7B9022D7598",
+        "000000000000000000000000000000000000000000000000000000000000805A",
+        "0000000000000000000000000000000000000000000000000000000000000000",
+        "41ECE55743711A8C3CBF3783CD08C0EE4D4DC440D4641A8F366E550DFDB3BB67",
+    ),
 }
 
 CURVE_PARAMS = {}
@@ -63,86 +111,691 @@ for c, params in CURVE_PARAMS_TEXT.items():
 
 
 class GOST3410Curve(object):
+    """ Elliptic curve in short Weierstrass form
+
+    Points are passed around as affine (x, y) tuples, ``None`` stands for
+    the point at infinity. Scalar multiplication works in Jacobian
+    coordinates (X, Y, Z), x = X/Z^2, y = Y/Z^3, with Z = 0 at infinity,
+    so it needs a single modular inversion at the end.
+
+    Multiples of the base point use :class:`FixedBaseTable`, built on
+    first use. ``base_window`` bits of the scalar are handled per table
+    row: wider window means fewer additions, but the table grows as
+    (2^w - 1) * ceil(bits(q) / w) points. Zero disables the table.
+
+    Other points are multiplied with width ``wnaf_window`` NAF. Joint
+    multiplication keeps 2^(w-2) odd multiples of the base point with
+    ``base_wnaf_window`` width.
+
+    Arithmetic modulo p and q goes through ``field`` and ``scalars``
+    (see :func:`prime_field`), special form p of the TC26 sets is
+    reduced by folding.
+
+    Curves given with twisted Edwards parameters e, d are created as
+    :class:`TwistedEdwardsCurve`.
+    """
+    wnaf_window = 5
+    base_wnaf_window = 7
+    _infinity = (1, 1, 0)
+
+    def __new__(cls, *args, **kwargs):
+        e = args[6] if len(args) > 6 else kwargs.get("e")
+        if cls is GOST3410Curve and e is not None:
+            cls = TwistedEdwardsCurve
+        return super(GOST3410Curve, cls).__new__(cls)
+
     def __iter__(self):
         for i in [self.p, self.q, self.a, self.b, self.x, self.y]:
             yield i
 
-    def __init__(self, p, q, a, b, x, y):
+    def __getstate__(self):
+        # Precomputed tables are cheaper to rebuild than to pickle
+        state = self.__dict__.copy()
+        state["_base_table"] = None
+        state["_base_odd"] = None
+        return state
+
+    def __init__(self, p, q, a, b, x, y, e=None, d=None, base_window=4):
         self.p = bytes2long(p)
         self.q = bytes2long(q)
         self.a = bytes2long(a)
         self.b = bytes2long(b)
         self.x = bytes2long(x)
         self.y = bytes2long(y)
-        r1 = self.y * self.y % self.p
-        r2 = ((self.x * self.x + self.a) * self.x + self.b) % self.p
-        if r2 < 0:
-            r2 += self.p
+        # Coordinates, private keys and signature halves length, bytes
+        self.point_size = (self.p.bit_length() + 7) // 8
+        self.field = prime_field(self.p)
+        self.scalars = prime_field(self.q)
+        red = self.field.red
+        r1 = red(self.y * self.y)
+        r2 = red((self.x * self.x + self.a) * self.x + self.b)
         if r1 != r2:
             raise ValueError("Invalid parameters")
+        # Both TC26 512-bit sets have a = -3, that saves doubling work
+        self._a_is_minus_3 = red(self.a + 3) == 0
+        self.base_window = base_window
+        self._base_table = None
+        self._base_odd = None
 
-    def _pos(self, v):
-        if v < 0:
-            return v + self.p
-        return v
+    def base_table(self):
+        """ Lazily built :class:`FixedBaseTable` of the base point
+        """
+        if self._base_table is None or self._base_table.window != self.base_window:
+            self._base_table = FixedBaseTable(self, self.x, self.y, self.base_window)
+        return self._base_table
 
     def _add(self, p1x, p1y, p2x, p2y):
-        if p1x == p2x and p1y == p2y:
-            t = ((3 * p1x * p1x + self.a) * modinvert(2 * p1y, self.p)) % self.p
+        """ Affine addition, None arguments and result are infinity
+        """
+        if p1x is None:
+            return p2x, p2y
+        if p2x is None:
+            return p1x, p1y
+        red = self.field.red
+        inv = self.field.inv
+        if p1x == p2x:
+            if red(p1y + p2y) == 0:
+                # P + (-P), including doubling of a point with y = 0
+                return None, None
+            t = red((3 * p1x * p1x + self.a) * inv(2 * p1y))
         else:
-            tx = self._pos(p2x - p1x) % self.p
-            ty = self._pos(p2y - p1y) % self.p
-            t = (ty * modinvert(tx, self.p)) % self.p
-        tx = self._pos(t * t - p1x - p2x) % self.p
-        ty = self._pos(t * (p1x - tx) - p1y) % self.p
+            t = red((p2y - p1y) * inv(p2x - p1x))
+        tx = red(t * t - p1x - p2x)
+        ty = red(t * (p1x - tx) - p1y)
         return tx, ty
 
+    def _projective(self, x, y):
+        """ Affine point, None is infinity, in coordinates of scalar multiplication
+        """
+        if x is None:
+            return self._infinity
+        return x, y, 1
+
+    def _jdouble(self, X, Y, Z):
+        """ Jacobian doubling
+        """
+        red = self.field.red
+        if not Z or not Y:
+            return 1, 1, 0
+        YY = red(Y * Y)
+        S = red(4 * X * YY)
+        ZZ = red(Z * Z)
+        if self._a_is_minus_3:
+            M = red(3 * (X - ZZ) * (X + ZZ))
+        else:
+            M = red(3 * X * X + self.a * red(ZZ * ZZ))
+        X3 = red(M * M - 2 * S)
+        Y3 = red(M * (S - X3) - 8 * red(YY * YY))
+        Z3 = red(2 * Y * Z)
+        return X3, Y3, Z3
+
+    def _jadd_affine(self, X1, Y1, Z1, x2, y2):
+        """ Mixed addition of Jacobian and affine points
+        """
+        red = self.field.red
+        if not Z1:
+            return x2, y2, 1
+        Z1Z1 = red(Z1 * Z1)
+        H = red(x2 * Z1Z1 - X1)
+        r = red(y2 * red(Z1 * Z1Z1) - Y1)
+        if not H:
+            if not r:
+                return self._jdouble(X1, Y1, Z1)
+            return 1, 1, 0
+        HH = red(H * H)
+        HHH = red(H * HH)
+        V = red(X1 * HH)
+        X3 = red(r * r - HHH - 2 * V)
+        Y3 = red(r * (V - X3) - Y1 * HHH)
+        Z3 = red(Z1 * H)
+        return X3, Y3, Z3
+
+    def _jadd(self, X1, Y1, Z1, X2, Y2, Z2):
+        """ Jacobian addition
+        """
+        red = self.field.red
+        if not Z1:
+            return X2, Y2, Z2
+        if not Z2:
+            return X1, Y1, Z1
+        Z1Z1 = red(Z1 * Z1)
+        Z2Z2 = red(Z2 * Z2)
+        U1 = red(X1 * Z2Z2)
+        S1 = red(Y1 * red(Z2 * Z2Z2))
+        H = red(X2 * Z1Z1 - U1)
+        r = red(Y2 * red(Z1 * Z1Z1) - S1)
+        if not H:
+            if not r:
+                return self._jdouble(X1, Y1, Z1)
+            return 1, 1, 0
+        HH = red(H * H)
+        HHH = red(H * HH)
+        V = red(U1 * HH)
+        X3 = red(r * r - HHH - 2 * V)
+        Y3 = red(r * (V - X3) - S1 * HHH)
+        Z3 = red(red(Z1 * Z2) * H)
+        return X3, Y3, Z3
+
+    def _batch_to_affine(self, points):
+        """ Convert many Jacobian points with a single inversion
+        """
+        red = self.field.red
+        zinvs = iter(self.field.inv_many([Z for _, _, Z in points if Z]))
+        res = []
+        for X, Y, Z in points:
+            if not Z:
+                res.append((None, None))
+                continue
+            zinv = next(zinvs)
+            zinv2 = red(zinv * zinv)
+            res.append((red(X * zinv2), red(Y * red(zinv2 * zinv))))
+        return res
+
+    def _to_affine(self, X, Y, Z):
+        if not Z:
+            return None, None
+        red = self.field.red
+        zinv = self.field.inv(Z)
+        zinv2 = red(zinv * zinv)
+        return red(X * zinv2), red(Y * red(zinv2 * zinv))
+
+    def _batch_to_table(self, points):
+        """ Convert many points to table entries for :meth:`_jadd_affine`
+
+        Entries are affine points, (None, None) for infinity.
+        """
+        return self._batch_to_affine(points)
+
+    def _neg_table(self, entry):
+        x, y = entry
+        return x, self.field.red(-y)
+
+    def _odd_multiples(self, x, y, window):
+        """ P, 3P, 5P, ..., (2^(window-1) - 1)P as table entries
+        """
+        point = self._projective(x, y)
+        double = self._jdouble(*point)
+        points = [point]
+        for _ in range((1 << (window - 2)) - 1):
+            points.append(self._jadd(*(points[-1] + double)))
+        return self._batch_to_table(points)
+
+    def base_odd_multiples(self):
+        """ Lazily built odd multiples of the base point for exp_sum
+        """
+        if self._base_odd is None:
+            self._base_odd = self._odd_multiples(self.x, self.y, self.base_wnaf_window)
+        return self._base_odd
+
+    def _wnaf_sum(self, terms):
+        """ Sum of degree * P over (degree, odd multiples of P, window) terms
+
+        Width-w NAF digits of all degrees are interleaved over one
+        doubling chain. Negative digits add the negated table point,
+        which is cheap: -(x, y) = (x, -y).
+        """
+        nafs = [(wnaf(degree, window), table) for degree, table, window in terms]
+        point = self._infinity
+        for i in range(max(len(naf) for naf, _ in nafs) - 1, -1, -1):
+            point = self._jdouble(*point)
+            for naf, table in nafs:
+                if i >= len(naf) or not naf[i]:
+                    continue
+                digit = naf[i]
+                entry = table[abs(digit) >> 1]
+                if entry[0] is None:
+                    continue
+                if digit < 0:
+                    entry = self._neg_table(entry)
+                point = self._jadd_affine(*(point + entry))
+        return point
+
     def exp(self, degree, x=None, y=None):
-        x = x or self.x
-        y = y or self.y
-        tx = x
-        ty = y
-        degree -= 1
-        if degree == 0:
+        """ Scalar multiplication: degree * (x, y)
+
+        Base point is used when (x, y) are not specified, through the
+        fixed-base table. Other points use width ``wnaf_window`` NAF
+        with a per-call table of odd multiples.
+        Returns (None, None) for the point at infinity.
+        """
+        if degree < 0:
             raise ValueError("Bad degree value")
-        while degree != 0:
-            if degree & 1 == 1:
-                tx, ty = self._add(tx, ty, x, y)
-            degree = degree >> 1
-            x, y = self._add(x, y, x, y)
-        return tx, ty
+        if x is None:
+            if self.base_window:
+                return self.base_table().mul(degree)
+            x, y = self.x, self.y
+        table = self._odd_multiples(x, y, self.wnaf_window)
+        return self._to_affine(*self._wnaf_sum([(degree, table, self.wnaf_window)]))
+
+    def exp_sum(self, degree1, degree2, x, y):
+        """ Joint multiplication: degree1 * base + degree2 * (x, y)
+
+        Interleaved wNAF: both scalars share one doubling chain. Odd
+        multiples of the base point are kept between calls, so they use
+        a wider window.
+        Returns (None, None) for the point at infinity.
+        """
+        return self._to_affine(*self._exp_sum_jacobian(degree1, degree2, x, y))
+
+    def _exp_sum_jacobian(self, degree1, degree2, x, y):
+        if degree1 < 0 or degree2 < 0:
+            raise ValueError("Bad degree value")
+        return self._wnaf_sum([
+            (degree1, self.base_odd_multiples(), self.base_wnaf_window),
+            (degree2, self._odd_multiples(x, y, self.wnaf_window), self.wnaf_window),
+        ])
+
+
+class TwistedEdwardsCurve(GOST3410Curve):
+    """ Curve that also has twisted Edwards form e*u^2 + v^2 = 1 + d*u^2*v^2
+
+    Points are still passed around in short Weierstrass form, but scalar
+    multiplication works in extended Edwards coordinates (X, Y, T, Z),
+    u = X/Z, v = Y/Z, T = X*Y/Z. With square e and non-square d the
+    addition law is complete: the same formulas serve doubling, the
+    neutral point (0, 1) and any other input, without special cases.
+    Table entries are (u, v, d*u*v). Methods keep the Jacobian names
+    of :class:`GOST3410Curve`.
+
+    Weierstrass and Edwards forms are birationally equivalent, with
+    s = (e - d) / 4 and t = (e + d) / 6 (:rfc:`7836`):
+    u = (x - t) / y, v = (x - t - s) / (x - t + s).
+    """
+    _infinity = (0, 1, 0, 1)
+
+    def __init__(self, p, q, a, b, x, y, e=None, d=None, base_window=4):
+        super(TwistedEdwardsCurve, self).__init__(p, q, a, b, x, y, base_window=base_window)
+        if e is None or d is None:
+            raise ValueError("Edwards parameters are required")
+        self.e = bytes2long(e)
+        self.d = bytes2long(d)
+        red = self.field.red
+        inv = self.field.inv
+        self._s = red((self.e - self.d) * inv(4))
+        self._t = red((self.e + self.d) * inv(6))
+        s, t = self._s, self._t
+        if red(s * s - 3 * t * t - self.a) or red(2 * t * t * t - t * s * s - self.b):
+            raise ValueError("Invalid Edwards parameters")
+        half = (self.p - 1) // 2
+        if pow(self.e, half, self.p) != 1 or pow(self.d, half, self.p) != self.p - 1:
+            raise ValueError("Incomplete Edwards addition law")
+
+    def _projective(self, x, y):
+        if x is None:
+            return self._infinity
+        red = self.field.red
+        w = x - self._t
+        if not y:
+            if red(w):
+                raise ValueError("Point is not on the curve")
+            # The only point of order two
+            return 0, self.p - 1, 0, 1
+        ws = red(w + self._s)
+        if not ws:
+            raise ValueError("Point is not on the curve")
+        den = self.field.inv(y * ws)
+        u = red(red(w * ws) * den)
+        v = red(red((w - self._s) * y) * den)
+        return u, v, red(u * v), 1
+
+    def _jdouble(self, X, Y, T, Z):
+        """ Extended Edwards doubling, dbl-2008-hwcd
+        """
+        red = self.field.red
+        A = red(X * X)
+        B = red(Y * Y)
+        C = red(2 * Z * Z)
+        D = red(self.e * A)
+        E = red((X + Y) * (X + Y) - A - B)
+        G = D + B
+        F = G - C
+        H = D - B
+        return red(E * F), red(G * H), red(E * H), red(F * G)
+
+    def _jadd_affine(self, X1, Y1, T1, Z1, u2, v2, duv2):
+        """ Mixed extended Edwards addition with a table entry
+        """
+        red = self.field.red
+        A = red(X1 * u2)
+        B = red(Y1 * v2)
+        C = red(T1 * duv2)
+        E = red((X1 + Y1) * (u2 + v2) - A - B)
+        F = Z1 - C
+        G = Z1 + C
+        H = B - self.e * A
+        return red(E * F), red(G * H), red(E * H), red(F * G)
+
+    def _jadd(self, X1, Y1, T1, Z1, X2, Y2, T2, Z2):
+        """ Extended Edwards addition, add-2008-hwcd
+        """
+        red = self.field.red
+        A = red(X1 * X2)
+        B = red(Y1 * Y2)
+        C = red(red(T1 * T2) * self.d)
+        D = red(Z1 * Z2)
+        E = red((X1 + Y1) * (X2 + Y2) - A - B)
+        F = D - C
+        G = D + C
+        H = B - self.e * A
+        return red(E * F), red(G * H), red(E * H), red(F * G)
+
+    def _affine(self, X, Y, Z, winv):
+        """ Weierstrass point of extended Edwards one, 1 / ((Z - Y) * X) given
+        """
+        red = self.field.red
+        k = red(self._s * (Z + Y) * winv)
+        return red(k * X + self._t), red(k * Z)
+
+    def _batch_to_affine(self, points):
+        red = self.field.red
+        res = [None] * len(points)
+        todo = []
+        for i, (X, Y, _, Z) in enumerate(points):
+            if X:
+                todo.append(i)
+            elif red(Y - Z):
+                res[i] = (self._t, 0)
+            else:
+                res[i] = (None, None)
+        if todo:
+            winvs = self.field.inv_many([
+                (points[i][3] - points[i][1]) * points[i][0] for i in todo
+            ])
+            for i, winv in zip(todo, winvs):
+                X, Y, _, Z = points[i]
+                res[i] = self._affine(X, Y, Z, winv)
+        return res
+
+    def _to_affine(self, X, Y, T, Z):
+        red = self.field.red
+        if not X:
+            if red(Y - Z):
+                return self._t, 0
+            return None, None
+        return self._affine(X, Y, Z, self.field.inv((Z - Y) * X))
+
+    def _batch_to_table(self, points):
+        red = self.field.red
+        res = []
+        for (X, Y, _, Z), zinv in zip(points, self.field.inv_many([Z for _, _, _, Z in points])):
+            u = red(X * zinv)
+            v = red(Y * zinv)
+            res.append((u, v, red(red(u * v) * self.d)))
+        return res
+
+    def _neg_table(self, entry):
+        u, v, duv = entry
+        red = self.field.red
+        return red(-u), v, red(-duv)
+
+
+def wnaf(degree, window):
+    """ Width-w non-adjacent form of the number
+
+    :returns: signed odd digits below 2^(window-1) by absolute value,
+              least significant first, nonzero digits are at least
+              ``window`` positions apart
+    """
+    digits = []
+    full = 1 << window
+    half = full >> 1
+    while degree:
+        if degree & 1:
+            digit = degree & (full - 1)
+            if digit >= half:
+                digit -= full
+            degree -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        degree >>= 1
+    return digits
+
+
+class FixedBaseTable(object):
+    """ Precomputed multiples of a fixed point
+
+    Row i holds j * 2^(w*i) * P for j in 1..2^w-1 as affine points, so
+    k * P is a sum of one entry per row picked by w-bit digits of k:
+    about bits(q) / w mixed additions and no doublings at all.
+    """
+
+    def __init__(self, curve, x, y, window=4):
+        if window < 1:
+            raise ValueError("Bad window value")
+        self.curve = curve
+        self.x = x
+        self.y = y
+        self.window = window
+        self.rows = -(-curve.q.bit_length() // window)
+        width = (1 << window) - 1
+        points = []
+        base = curve._projective(x, y)
+        for _ in range(self.rows):
+            acc = base
+            points.append(acc)
+            for _ in range(width - 1):
+                acc = curve._jadd(*(acc + base))
+                points.append(acc)
+            base = curve._jadd(*(acc + base))
+        points = curve._batch_to_table(points)
+        self.table = [points[i * width:(i + 1) * width] for i in range(self.rows)]
+        # Approximate memory held by the table
+        self.nbytes = getsizeof(self.table) + sum(
+            getsizeof(row) for row in self.table
+        ) + sum(
+            getsizeof(point) + sum(getsizeof(v) for v in point)
+            for point in points
+        )
+
+    @staticmethod
+    def estimate_nbytes(curve, window=4):
+        """ Approximate :attr:`nbytes` of a table, without building it
+        """
+        rows = -(-curve.q.bit_length() // window)
+        count = rows * ((1 << window) - 1)
+        entry = curve._batch_to_table([curve._projective(curve.x, curve.y)])[0]
+        point = getsizeof(entry) + len(entry) * getsizeof(curve.p)
+        return getsizeof([None] * rows) + rows * getsizeof([None] * ((1 << window) - 1)) + count * point
+
+    def mul_jacobian(self, k):
+        """ k * P in projective coordinates of the curve
+        """
+        curve = self.curve
+        if k >> (self.window * self.rows):
+            # Out of table range, do not assume anything about P order
+            return curve._projective(*curve.exp(k, self.x, self.y))
+        mask = (1 << self.window) - 1
+        point = curve._infinity
+        shift = 0
+        for row in self.table:
+            digit = (k >> shift) & mask
+            if digit:
+                entry = row[digit - 1]
+                if entry[0] is not None:
+                    point = curve._jadd_affine(*(point + entry))
+            shift += self.window
+        return point
+
+    def mul(self, k):
+        """ k * P as affine point
+        """
+        return self.curve._to_affine(*self.mul_jacobian(k))
+
+
+class PublicKeyCache(object):
+    """ Bounded LRU cache of :class:`FixedBaseTable` per public key
+
+    Verifiers seeing the same signer keys over and over get fixed-base
+    speed for the public key term too. Tables are evicted, least
+    recently used first, once their total size exceeds ``max_bytes``.
+
+    A table costs about as much as a dozen verifications without it, so
+    :meth:`lookup` builds one only for a key seen ``min_uses`` times.
+    No table is built for a curve whose tables do not fit ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes=64 << 20, window=4, min_uses=16, max_seen=4096):
+        """
+        :param int max_bytes: memory cap for all tables
+        :param int window: window width of the tables
+        :param int min_uses: lookups of a key before its table is built
+        :param int max_seen: most keys without a table to count uses of
+        """
+        self.max_bytes = max_bytes
+        self.window = window
+        self.min_uses = min_uses
+        self.max_seen = max_seen
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tables = OrderedDict()
+        self._seen = OrderedDict()
+        self._fits = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __contains__(self, item):
+        curve, pub = item
+        return (type(curve), tuple(curve), pub[0], pub[1]) in self._tables
+
+    def lookup(self, curve, pub):
+        """ Get the table for the public key, None if it is not worth one yet
+        """
+        if not self.fits(curve):
+            return None
+        key = (type(curve), tuple(curve), pub[0], pub[1])
+        with self._lock:
+            if key not in self._tables:
+                uses = self._seen.pop(key, 0) + 1
+                if uses < self.min_uses:
+                    self._seen[key] = uses
+                    while len(self._seen) > self.max_seen:
+                        self._seen.popitem(last=False)
+                    return None
+        return self.get(curve, pub)
+
+    def fits(self, curve):
+        """ Whether a table of the curve fits into ``max_bytes``
+        """
+        key = (type(curve), tuple(curve))
+        fits = self._fits.get(key)
+        if fits is None:
+            fits = self._fits[key] = FixedBaseTable.estimate_nbytes(curve, self.window) <= self.max_bytes
+        return fits
+
+    def get(self, curve, pub):
+        """ Get the table for the public key, building it on a miss
+
+        :returns: table, None if it would not fit into ``max_bytes``
+        """
+        # Tables of Edwards and Weierstrass arithmetic are not interchangeable
+        key = (type(curve), tuple(curve), pub[0], pub[1])
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                self.hits += 1
+                return table
+            self.misses += 1
+        if not self.fits(curve):
+            return None
+        table = FixedBaseTable(curve, pub[0], pub[1], self.window)
+        with self._lock:
+            if key not in self._tables:
+                self._tables[key] = table
+                self.nbytes += table.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._tables.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+        return table
+
+    def stats(self):
+        return {
+            "entries": len(self._tables),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self._seen.clear()
+            self.nbytes = 0
+
+
+def _random_scalar(curve):
+    """ Random number in [1, q - 1]
+    """
+    # Extra 64 bits keep it uniform enough even for q far below 2^(8*size)
+    size = curve.point_size + 8
+    while True:
+        k = curve.scalars.red(bytes2long(urandom(size)))
+        if k:
+            return k
 
 
 def public_key(curve, prv):
     return curve.exp(prv)
 
 
+def private_key(curve):
+    """ Random private key in [1, q - 1]
+    """
+    return _random_scalar(curve)
+
+
+def generate_keys(curve, count, batch_size=1024):
+    """ Generate many key pairs
+
+    :param GOST3410Curve curve: curve
+    :param int count: number of key pairs
+    :param int batch_size: public keys converted to affine coordinates
+                           with a single inversion
+    :returns: iterator of (prv, pub) pairs
+    """
+    base = curve.base_table() if curve.base_window else None
+    while count > 0:
+        prvs = [private_key(curve) for _ in range(min(count, batch_size))]
+        count -= len(prvs)
+        if base is None:
+            pubs = [curve.exp(prv) for prv in prvs]
+        else:
+            pubs = curve._batch_to_affine([base.mul_jacobian(prv) for prv in prvs])
+        for pair in zip(prvs, pubs):
+            yield pair
+
+
 def sign(curve, prv, digest, mode=2012):
     """
     :param GOST3410Curve curve: curve
     :param long prv: private key
     :param digest: digest for signing
     :type digest: bytes, 32 or 64 bytes
+    :param mode: unused, sizes follow ``curve.point_size``
     :returns: signature
     :rtype: int tuple
     """
-    # size = MODE2SIZE[mode]
-    size = 64
-    q = curve.q
-    e = bytes2long(digest) % q
+    red = curve.scalars.red
+    e = red(bytes2long(digest))
     if e == 0:
         e = 1
     while True:
-        k = bytes2long(urandom(size)) % q
-        if k == 0:
-            continue
+        k = _random_scalar(curve)
         r, _ = curve.exp(k)
-        r %= q
+        r = red(r)
         if r == 0:
             continue
         d = prv * r
         k *= e
-        s = (d + k) % q
+        s = red(d + k)
         if s == 0:
             continue
         break
@@ -150,7 +803,165 @@ def sign(curve, prv, digest, mode=2012):
     return r, s
 
 
-def verify(curve, pub, digest, signature, mode=2012):
+class PrecomputedSigner(object):
+    """ Signer with a pool of precomputed nonces
+
+    Almost all of :func:`sign` is k * G for a fresh random k, which does
+    not depend on the message. The signer keeps up to ``capacity``
+    (k, r = (k * G).x mod q) pairs, so signing is a few multiplications
+    modulo q. Every pair is removed from the pool when taken and is never
+    used twice. A background thread refills the pool up to ``capacity``
+    once it drops below ``low_watermark``, ``batch_size`` pairs with a
+    single inversion at a time. An empty pool falls back to computing
+    the nonce in place.
+
+    The refill thread shares the interpreter lock with signing, so the
+    pool pays off when signing comes in bursts::
+
+        with PrecomputedSigner(curve, prv) as signer:
+            r, s = signer.sign(digest)
+    """
+
+    def __init__(self, curve, prv, capacity=1024, low_watermark=None, batch_size=64, start=True):
+        """
+        :param GOST3410Curve curve: curve
+        :param long prv: private key
+        :param int capacity: most pairs kept
+        :param int low_watermark: refill when less pairs left,
+                                  quarter of capacity by default
+        :param int batch_size: pairs computed at once
+        :param bool start: start the refill thread
+        """
+        self.curve = curve
+        self._prv = prv
+        self.capacity = capacity
+        self.low_watermark = capacity // 4 if low_watermark is None else low_watermark
+        self.batch_size = batch_size
+        self._pool = deque()
+        self._lock = Lock()
+        self._wanted = Event()
+        self._closed = Event()
+        self._thread = None
+        self.signed = 0
+        self.misses = 0
+        self.generated = 0
+        self.generate_seconds = 0.0
+        self.refills = 0
+        # Lowest number of pairs left after a signing
+        self.min_size = None
+        if start:
+            self.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._pool)
+
+    def start(self):
+        """ Start the refill thread, the pool is filled right away
+        """
+        if self._thread is not None:
+            return
+        self._wanted.set()
+        self._thread = Thread(target=self._refiller, name="nonce-pool")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        """ Stop the refill thread and forget all precomputed pairs
+        """
+        self._closed.set()
+        self._wanted.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._pool.clear()
+
+    def _refiller(self):
+        while True:
+            self._wanted.wait()
+            if self._closed.is_set():
+                return
+            self._wanted.clear()
+            while not self._closed.is_set() and len(self._pool) < self.capacity:
+                self.fill(min(self.batch_size, self.capacity - len(self._pool)))
+            self.refills += 1
+
+    def fill(self, count):
+        """ Compute and add count pairs to the pool
+        """
+        curve = self.curve
+        red = curve.scalars.red
+        start = time()
+        ks = [_random_scalar(curve) for _ in range(count)]
+        if curve.base_window:
+            base = curve.base_table()
+            points = curve._batch_to_affine([base.mul_jacobian(k) for k in ks])
+        else:
+            points = [curve.exp(k) for k in ks]
+        pairs = [(k, red(x)) for k, (x, _) in zip(ks, points) if x is not None and red(x)]
+        with self._lock:
+            self._pool.extend(pairs)
+            self.generated += len(pairs)
+            self.generate_seconds += time() - start
+
+    def _take(self):
+        with self._lock:
+            if self._pool:
+                pair = self._pool.popleft()
+                size = len(self._pool)
+                if self.min_size is None or size < self.min_size:
+                    self.min_size = size
+            else:
+                pair = None
+                size = 0
+        if size < self.low_watermark:
+            self._wanted.set()
+        if pair is not None:
+            return pair
+        self.misses += 1
+        while True:
+            k = _random_scalar(self.curve)
+            r = self.curve.scalars.red(self.curve.exp(k)[0])
+            if r:
+                return k, r
+
+    def sign(self, digest):
+        """ Same as :func:`sign` with the signer's curve and key
+        """
+        red = self.curve.scalars.red
+        e = red(bytes2long(digest))
+        if e == 0:
+            e = 1
+        while True:
+            k, r = self._take()
+            s = red(self._prv * r + k * e)
+            if s:
+                break
+        self.signed += 1
+        return r, s
+
+    def stats(self):
+        return {
+            "size": len(self._pool),
+            "capacity": self.capacity,
+            "low_watermark": self.low_watermark,
+            "min_size": self.min_size,
+            "signed": self.signed,
+            "misses": self.misses,
+            "generated": self.generated,
+            "refills": self.refills,
+            # Pairs per second of computation
+            "refill_rate": self.generated / self.generate_seconds if self.generate_seconds else None,
+        }
+
+
+def verify(curve, pub, digest, signature, mode=2012, cache=None):
     """
     :param GOST3410Curve curve: curve
     :type pub: (long, long)
@@ -158,53 +969,118 @@ def verify(curve, pub, digest, signature, mode=2012):
     :type digest: bytes, 32 or 64 bytes
     :param signature: r, s from signature
     :type signature: bytes, 64 or 128 bytes
+    :param mode: unused, sizes follow ``curve.point_size``
+    :param PublicKeyCache cache: precomputed public key tables, one is
+                                 built for a key seen often enough
     :rtype: bool
     """
     r, s = signature
-    # size = MODE2SIZE[mode]
-    size = 64
+    size = curve.point_size
     if len(long2bytes(s, size) + long2bytes(r, size)) != size * 2:
         raise ValueError("Invalid signature length")
     q = curve.q
-    p = curve.p
     # s = bytes2long(signature[:size])
     # r = bytes2long(signature[size:])
     if r <= 0 or r >= q or s <= 0 or s >= q:
         return False
-    e = bytes2long(digest) % curve.q
+    red = curve.scalars.red
+    e = red(bytes2long(digest))
     if e == 0:
         e = 1
-    v = modinvert(e, q)
-    z1 = s * v % q
-    z2 = q - r * v % q
-    p1x, p1y = curve.exp(z1)
-    q1x, q1y = curve.exp(z2, pub[0], pub[1])
-    lm = q1x - p1x
-    if lm < 0:
-        lm += p
-    lm = modinvert(lm, p)
-    z1 = q1y - p1y
-    lm = lm * z1 % p
-    lm = lm * lm % p
-    lm = lm - p1x - q1x
-    lm = lm % p
-    if lm < 0:
-        lm += p
-    lm %= q
+    v = curve.scalars.inv(e)
+    z1 = red(s * v)
+    z2 = q - red(r * v)
+    table = cache.lookup(curve, pub) if cache is not None and curve.base_window else None
+    if table is not None:
+        point = curve.base_table().mul_jacobian(z1) + table.mul_jacobian(z2)
+        cx, _ = curve._to_affine(*curve._jadd(*point))
+    else:
+        cx, _ = curve.exp_sum(z1, z2, pub[0], pub[1])
+    if cx is None:
+        return False
+    lm = red(cx)
     # This is not constant time comparison!
     return lm == r
 
 
+def verify_many(curve, items, cache=None, table_min_uses=16, batch_size=1024):
+    """ Verify many signatures at once
+
+    :param GOST3410Curve curve: curve
+    :param items: iterable of (pub, digest, (r, s)) tuples
+    :param PublicKeyCache cache: precomputed public key tables, batch
+                                 local cache is used if not specified
+    :param int table_min_uses: build a table for a public key seen at
+                               least that many times within a batch
+    :param int batch_size: items processed together
+    :returns: verification result per item
+    :rtype: list of bool
+
+    Work is shared within every ``batch_size`` items: one batched
+    inversion for all digests modulo q, one for converting all results
+    to affine coordinates, and fixed-base tables for public keys that
+    repeat (or already are in the cache).
+    """
+    if cache is None:
+        cache = PublicKeyCache()
+    items = iter(items)
+    results = []
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return results
+        results += _verify_batch(curve, batch, cache, table_min_uses)
+
+
+def _verify_batch(curve, items, cache, table_min_uses):
+    q = curve.q
+    red = curve.scalars.red
+    results = [False] * len(items)
+    valid = []
+    for i, (pub, digest, (r, s)) in enumerate(items):
+        if r <= 0 or r >= q or s <= 0 or s >= q:
+            continue
+        e = red(bytes2long(digest))
+        if e == 0:
+            e = 1
+        valid.append((i, tuple(pub), e, r, s))
+    if not valid:
+        return results
+    uses = Counter(pub for _, pub, _, _, _ in valid)
+    base = curve.base_table() if curve.base_window and cache.fits(curve) else None
+    points = []
+    for (_, pub, _, r, s), v in zip(valid, curve.scalars.inv_many([e for _, _, e, _, _ in valid])):
+        z1 = red(s * v)
+        z2 = q - red(r * v)
+        if base is not None and (uses[pub] >= table_min_uses or (curve, pub) in cache):
+            point = base.mul_jacobian(z1) + cache.get(curve, pub).mul_jacobian(z2)
+            points.append(curve._jadd(*point))
+        else:
+            points.append(curve._exp_sum_jacobian(z1, z2, pub[0], pub[1]))
+    for (i, _, _, r, _), (cx, _) in zip(valid, curve._batch_to_affine(points)):
+        results[i] = cx is not None and red(cx) == r
+    return results
+
+
+def prv_marshal(prv, curve):
+    """ Little-endian private key, ``curve.point_size`` long
+    """
+    return long2bytes(prv, curve.point_size)[::-1]
+
+
 def prv_unmarshal(prv):
     return bytes2long(prv[::-1])
 
 
-def pub_marshal(pub, mode=2012):
-    size = MODE2SIZE[mode]
+def pub_marshal(pub, mode=2012, curve=None):
+    """ Little-endian x || y, coordinates are ``curve.point_size`` long
+    if the curve is given, MODE2SIZE[mode] otherwise
+    """
+    size = MODE2SIZE[mode] if curve is None else curve.point_size
     return (long2bytes(pub[1], size) + long2bytes(pub[0], size))[::-1]
 
 
-def pub_unmarshal(pub, mode=2012):
-    size = MODE2SIZE[mode]
+def pub_unmarshal(pub, mode=2012, curve=None):
+    size = MODE2SIZE[mode] if curve is None else curve.point_size
     pub = pub[::-1]
     return bytes2long(pub[size:]), bytes2long(pub[:size])
@@ -19,16 +19,23 @@ This is implementation of :rfc:`6986`. Most function and variable names are
 taken according to specification's terminology.
 """
 
+from operator import xor
 from struct import pack
 from struct import unpack
+from struct import unpack_from
+
+try:
+    import numpy
+except ImportError:  # only digest_many() batch engine needs it
+    numpy = None
 
 from .utils import hexdec
 from .utils import hexenc
-from .utils import strxor
 from .utils import xrange
 
 
 BLOCKSIZE = 64
+MASK512 = (1 << 512) - 1
 Pi = bytearray((
     252, 238, 221,  17, 207, 110,  49,  22, 251, 196, 250,
     218,  35, 197,   4,  77, 233, 119, 240, 219, 147,  46,
@@ -160,34 +167,13 @@ C = [hexdec("".join(s))[::-1] for s in (
         "faf417d5d9b21b9948bc924af11bd720",
     ),
 )]
-
-
-def add512bit(a, b):
-    """ Add two 512 integers
-    """
-    a = bytearray(a)
-    b = bytearray(b)
-    cb = 0
-    res = bytearray(64)
-    for i in range(64):
-        cb = a[i] + b[i] + (cb >> 8)
-        res[i] = cb & 0xff
-    return res
-
-
-def g(n, hsh, msg):
-    res = E(LPS(strxor(hsh[:8], pack("<Q", n)) + hsh[8:]), msg)
-    return strxor(strxor(res, hsh), msg)
-
-
-def E(k, msg):
-    for i in range(12):
-        msg = LPS(strxor(k, msg))
-        k = LPS(strxor(k, C[i]))
-    return strxor(k, msg)
+# Internal state is kept as eight little-endian 64-bit words
+C_WORDS = [unpack("<8Q", c) for c in C]
 
 
 def LPS(data):
+    """ Bit-serial reference LPS transformation
+    """
     return L(PS(bytearray(data)))
 
 
@@ -211,57 +197,466 @@ def L(data):
     return b''.join(res)
 
 
+def _lps_tables():
+    """ Precompute fused S-box, permutation and linear map tables
+
+    Tau sends byte i of the input word k into byte k of the output
+    word i, and L is linear over the bytes of a word, so
+    LPS(data) word i is XOR of tables[k][byte i of input word k].
+    """
+    tables = []
+    for k in range(8):
+        row = []
+        for byte in range(256):
+            sbyte = Pi[byte]
+            res64 = 0
+            for bit in range(8):
+                if sbyte & (1 << bit):
+                    res64 ^= A[63 - (k * 8 + bit)]
+            row.append(res64)
+        tables.append(tuple(row))
+    return tuple(tables)
+
+
+LPS_TABLES = _lps_tables()
+
+
+def LPS_table(words):
+    """ Table-driven LPS transformation over eight 64-bit words
+
+    Gives the same result as :func:`LPS`, but with 64 lookups in
+    :data:`LPS_TABLES` instead of bit by bit linear map.
+    """
+    T0, T1, T2, T3, T4, T5, T6, T7 = LPS_TABLES
+    w0, w1, w2, w3, w4, w5, w6, w7 = words
+    return (
+        T0[w0 & 0xff] ^ T1[w1 & 0xff] ^ T2[w2 & 0xff] ^ T3[w3 & 0xff] ^
+        T4[w4 & 0xff] ^ T5[w5 & 0xff] ^ T6[w6 & 0xff] ^ T7[w7 & 0xff],
+        T0[(w0 >> 8) & 0xff] ^ T1[(w1 >> 8) & 0xff] ^
+        T2[(w2 >> 8) & 0xff] ^ T3[(w3 >> 8) & 0xff] ^
+        T4[(w4 >> 8) & 0xff] ^ T5[(w5 >> 8) & 0xff] ^
+        T6[(w6 >> 8) & 0xff] ^ T7[(w7 >> 8) & 0xff],
+        T0[(w0 >> 16) & 0xff] ^ T1[(w1 >> 16) & 0xff] ^
+        T2[(w2 >> 16) & 0xff] ^ T3[(w3 >> 16) & 0xff] ^
+        T4[(w4 >> 16) & 0xff] ^ T5[(w5 >> 16) & 0xff] ^
+        T6[(w6 >> 16) & 0xff] ^ T7[(w7 >> 16) & 0xff],
+        T0[(w0 >> 24) & 0xff] ^ T1[(w1 >> 24) & 0xff] ^
+        T2[(w2 >> 24) & 0xff] ^ T3[(w3 >> 24) & 0xff] ^
+        T4[(w4 >> 24) & 0xff] ^ T5[(w5 >> 24) & 0xff] ^
+        T6[(w6 >> 24) & 0xff] ^ T7[(w7 >> 24) & 0xff],
+        T0[(w0 >> 32) & 0xff] ^ T1[(w1 >> 32) & 0xff] ^
+        T2[(w2 >> 32) & 0xff] ^ T3[(w3 >> 32) & 0xff] ^
+        T4[(w4 >> 32) & 0xff] ^ T5[(w5 >> 32) & 0xff] ^
+        T6[(w6 >> 32) & 0xff] ^ T7[(w7 >> 32) & 0xff],
+        T0[(w0 >> 40) & 0xff] ^ T1[(w1 >> 40) & 0xff] ^
+        T2[(w2 >> 40) & 0xff] ^ T3[(w3 >> 40) & 0xff] ^
+        T4[(w4 >> 40) & 0xff] ^ T5[(w5 >> 40) & 0xff] ^
+        T6[(w6 >> 40) & 0xff] ^ T7[(w7 >> 40) & 0xff],
+        T0[(w0 >> 48) & 0xff] ^ T1[(w1 >> 48) & 0xff] ^
+        T2[(w2 >> 48) & 0xff] ^ T3[(w3 >> 48) & 0xff] ^
+        T4[(w4 >> 48) & 0xff] ^ T5[(w5 >> 48) & 0xff] ^
+        T6[(w6 >> 48) & 0xff] ^ T7[(w7 >> 48) & 0xff],
+        T0[w0 >> 56] ^ T1[w1 >> 56] ^ T2[w2 >> 56] ^ T3[w3 >> 56] ^
+        T4[w4 >> 56] ^ T5[w5 >> 56] ^ T6[w6 >> 56] ^ T7[w7 >> 56],
+    )
+
+
+def LPS_reference(words):
+    """ Bit-serial :func:`LPS` over eight 64-bit words
+    """
+    return unpack("<8Q", LPS(pack("<8Q", *words)))
+
+
+BACKENDS = {
+    "reference": LPS_reference,
+    "table": LPS_table,
+}
+DEFAULT_BACKEND = "table"
+
+
+def g(n, hsh, msg, lps=LPS_table):
+    """ Compression function over eight 64-bit words
+    """
+    res = E(lps((hsh[0] ^ n,) + hsh[1:]), msg, lps)
+    return tuple(map(xor, map(xor, res, hsh), msg))
+
+
+def E(k, msg, lps=LPS_table):
+    for c in C_WORDS:
+        msg = lps(map(xor, k, msg))
+        k = lps(map(xor, k, c))
+    return map(xor, k, msg)
+
+
+ROUNDS = len(C)
+
+
+def _hex512(words):
+    """ 512-bit value as hex string, most significant digit first
+    """
+    return "%016x%016x%016x%016x%016x%016x%016x%016x" % tuple(reversed(words))
+
+
+class RoundTrace(object):
+    """ Round by round record of the compression function
+
+    Every compression adds :data:`ROUNDS` entries of (K, state, LPS
+    output), where LPS output is LPS(K xor state) and becomes the state
+    of the next round. Each entry is a tuple of eight 64-bit words.
+
+    With ``stream`` given, rounds are written there as ``$readmemh``
+    lines instead, three 512-bit hex values per round, as
+    ``streebog_tb.sv`` literals are written, so the testbench can load
+    them into ``logic [511:0] mem[]``.
+    """
+
+    def __init__(self, capacity=0, stream=None):
+        """
+        :param int capacity: number of compressions to preallocate for
+        :param stream: writable text file for ``$readmemh`` output
+        """
+        self.records = [None] * capacity
+        self.count = 0
+        self.stream = stream
+
+    def record(self, rounds):
+        """ Add rounds of one compression
+        """
+        if self.stream is not None:
+            lines = ["// compression %d" % self.count]
+            for k, state, out in rounds:
+                lines += [_hex512(k), _hex512(state), _hex512(out)]
+            self.stream.write("\n".join(lines) + "\n")
+        elif self.count < len(self.records):
+            self.records[self.count] = rounds
+        else:
+            self.records.append(rounds)
+        self.count += 1
+
+    def record_array(self, rounds):
+        """ Add rounds of many compressions at once
+
+        Records are the same tuples :meth:`record` gets from the scalar
+        compression function.
+
+        :param rounds: (compressions x ROUNDS x 3 x 8) uint64 NumPy array
+        """
+        if self.stream is None:
+            for compression in rounds.tolist():
+                self.record([(tuple(k), tuple(state), tuple(out)) for k, state, out in compression])
+            return
+        values = numpy.ascontiguousarray(rounds[..., ::-1], dtype=">u8")
+        text = values.tobytes().hex()
+        step = ROUNDS * 3 * 128
+        for i in xrange(len(rounds)):
+            chunk = text[i * step:(i + 1) * step]
+            self.stream.write("// compression %d\n" % self.count)
+            self.stream.write("\n".join(
+                chunk[j:j + 128] for j in xrange(0, step, 128)
+            ) + "\n")
+            self.count += 1
+
+
+def traced_g(trace):
+    """ Compression function recording every round into the trace
+
+    Only :class:`GOST341112` objects created with a trace use it, the
+    plain :func:`g` stays untouched.
+    """
+    def compress(n, hsh, msg, lps=LPS_table):
+        k = lps((hsh[0] ^ n,) + hsh[1:])
+        state = msg
+        rounds = []
+        for c in C_WORDS:
+            out = tuple(lps(map(xor, k, state)))
+            rounds.append((k, state, out))
+            state = out
+            k = tuple(lps(map(xor, k, c)))
+        trace.record(rounds)
+        return tuple(map(xor, map(xor, map(xor, k, state), hsh), msg))
+    return compress
+
+
 class GOST341112(object):
     """ GOST 34.11-12 big-endian hash
+
+    Hashing is incremental: every full block is compressed as soon as
+    it arrives, so memory use does not depend on the message length.
+
     >>> m = GOST341112(digest_size=256)
-    >>> m.update("foo")
-    >>> m.update("bar")
+    >>> m.update(b"foo")
+    >>> m.update(b"bar")
+    >>> m.hexdigest()
+    'e3c9fd89226d93b489a9fe27d686806e24a514e3787bca053c698ec4616ceb78'
+
+    The object follows :mod:`hashlib` interface, so a hasher fed with a
+    common prefix can be saved and forked per message with :meth:`copy`:
+
+    >>> prefix = GOST341112(b"foo", digest_size=256)
+    >>> m = prefix.copy()
+    >>> m.update(b"bar")
     >>> m.hexdigest()
     'e3c9fd89226d93b489a9fe27d686806e24a514e3787bca053c698ec4616ceb78'
     """
     block_size = BLOCKSIZE
 
-    def __init__(self, data=b'', digest_size=512):
+    def __init__(self, data=b'', digest_size=512, backend=DEFAULT_BACKEND, trace=None):
         """
-        :param digest_size: hash digest size to compute
+        :param digest_size: hash digest size to compute, in bits
         :type digest_size: 256 or 512
+        :param backend: LPS implementation, one of :data:`BACKENDS` keys
+        :type backend: "table" or "reference"
+        :param trace: :class:`RoundTrace` to record every compression into
         """
-        self.digest_size = digest_size
-        self.data = data
+        if backend not in BACKENDS:
+            raise ValueError("Unknown backend: %s" % backend)
+        if digest_size not in (256, 512):
+            raise ValueError("Invalid digest size: %s" % digest_size)
+        # As in hashlib, digest_size attribute is in bytes
+        self.digest_size = digest_size // 8
+        self.name = "streebog%d" % digest_size
+        self.backend = backend
+        self._lps = BACKENDS[backend]
+        self._g = g if trace is None else traced_g(trace)
+        self._hsh = 8 * (0x0101010101010101 if digest_size == 256 else 0,)
+        # Checksum is reduced modulo 2^512 only at finalization
+        self._chk = 0
+        self._n = 0
+        self._buf = b''
+        self.update(data)
 
     def update(self, data):
         """ Append data that has to be hashed
+
+        Only the tail shorter than :data:`BLOCKSIZE` is kept between calls.
+        """
+        data = memoryview(data).cast("B")
+        if self._buf:
+            need = BLOCKSIZE - len(self._buf)
+            self._buf += data[:need].tobytes()
+            data = data[need:]
+            if len(self._buf) < BLOCKSIZE:
+                return
+            self._compress(self._buf)
+            self._buf = b''
+        end = len(data) // BLOCKSIZE * BLOCKSIZE
+        hsh, chk, n, lps, compress = self._hsh, self._chk, self._n, self._lps, self._g
+        for i in xrange(0, end, BLOCKSIZE):
+            hsh = compress(n, hsh, unpack_from("<8Q", data, i), lps)
+            chk += int.from_bytes(data[i:i + BLOCKSIZE], "little")
+            n += 512
+        self._hsh, self._chk, self._n = hsh, chk, n
+        self._buf = data[end:].tobytes()
+
+    def copy(self):
+        """ Return a clone of the hash object
+
+        Only the compression state and the short tail are copied, so
+        forking a hasher after a long prefix is cheap.
         """
-        self.data += data
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def _compress(self, block):
+        self._hsh = self._g(self._n, self._hsh, unpack("<8Q", block), self._lps)
+        self._chk += int.from_bytes(block, "little")
+        self._n += 512
 
     def digest(self):
         """ Get hash of the provided data
+
+        The running state is left intact, so more data can be
+        appended afterwards.
         """
-        hsh = BLOCKSIZE * (b'\x01' if self.digest_size == 256 else b'\x00')
-        chk = BLOCKSIZE * b'\x00'
-        n = 0
-        data = self.data
-        for i in xrange(0, len(data) // BLOCKSIZE * BLOCKSIZE, BLOCKSIZE):
-            block = data[i:i + BLOCKSIZE]
-            hsh = g(n, hsh, block)
-            chk = add512bit(chk, block)
-            n += 512
+        lps = self._lps
+        compress = self._g
+        hsh = self._hsh
+        n = self._n
 
         # Padding
-        padblock_size = len(data) * 8 - n
-        data += b'\x01'
-        padlen = BLOCKSIZE - len(data) % BLOCKSIZE
-        if padlen != BLOCKSIZE:
-            data += b'\x00' * padlen
-
-        hsh = g(n, hsh, data[-BLOCKSIZE:])
-        n += padblock_size
-        chk = add512bit(chk, data[-BLOCKSIZE:])
-        hsh = g(0, hsh, pack("<Q", n) + 56 * b'\x00')
-        hsh = g(0, hsh, chk)
-        if self.digest_size == 256:
+        data = self._buf + b'\x01'
+        data += b'\x00' * (BLOCKSIZE - len(data))
+
+        hsh = compress(n, hsh, unpack("<8Q", data), lps)
+        n += len(self._buf) * 8
+        chk = (self._chk + int.from_bytes(data, "little")) & MASK512
+        hsh = compress(0, hsh, (n, 0, 0, 0, 0, 0, 0, 0), lps)
+        hsh = compress(0, hsh, unpack("<8Q", chk.to_bytes(BLOCKSIZE, "little")), lps)
+        hsh = pack("<8Q", *hsh)
+        if self.digest_size == 32:
             return hsh[32:]
         return hsh
 
     def hexdigest(self):
         return hexenc(self.digest())
+
+
+def streebog256(data=b''):
+    """ Streebog-256 constructor, usable as ``hmac`` digestmod
+    """
+    return GOST341112(data, digest_size=256)
+
+
+def streebog512(data=b''):
+    """ Streebog-512 constructor, usable as ``hmac`` digestmod
+    """
+    return GOST341112(data, digest_size=512)
+
+
+def _np_lps(state, tables):
+    """ Table-driven LPS over (N x 8) uint64 state array
+
+    :param tables: :data:`LPS_TABLES` flattened into 2048 uint64 array
+    """
+    rows = state.shape[0]
+    # idx[r, k, i] is byte i of word k, offset into the k-th table
+    idx = state.view(numpy.uint8).reshape(rows, 8, 8) + _NP_TABLE_OFFSETS
+    looked = tables.take(idx)
+    return numpy.bitwise_xor.reduce(looked, axis=1)
+
+
+def _np_g(n, hsh, msg, tables, consts, trace=None):
+    """
+    :param trace: (rows x ROUNDS x 3 x 8) array to store the rounds into
+    """
+    k = hsh.copy()
+    k[:, 0] ^= n
+    k = _np_lps(k, tables)
+    state = msg
+    for i, c in enumerate(consts):
+        out = _np_lps(k ^ state, tables)
+        if trace is not None:
+            trace[:, i, 0] = k
+            trace[:, i, 1] = state
+            trace[:, i, 2] = out
+        state = out
+        k = _np_lps(k ^ c, tables)
+    return k ^ state ^ hsh ^ msg
+
+
+def _np_add512(a, b):
+    """ Row-wise addition of 512-bit numbers stored as 8 uint64 words
+    """
+    res = a + b
+    carry = res < a
+    for i in xrange(1, 8):
+        word = res[:, i] + carry[:, i - 1]
+        carry[:, i] |= word < res[:, i]
+        res[:, i] = word
+    return res
+
+
+_NP_TABLE_OFFSETS = None
+
+
+def digest_many(messages, digest_size=512, trace=None):
+    """ Hash many messages in lockstep
+
+    The compression function runs on the (N x 8) uint64 state array of
+    all messages at once, with LPS lookups vectorized across messages.
+    Messages are ordered by the number of full blocks, so at every step
+    the still active ones form a leading slice of the state array. This
+    suits lots of short records; every digest is the same as
+    :class:`GOST341112` gives for that message.
+
+    Falls back to one :class:`GOST341112` per message when NumPy is
+    not installed.
+
+    :param messages: iterable of bytes-like messages
+    :param digest_size: hash digest size to compute, in bits
+    :type digest_size: 256 or 512
+    :param trace: :class:`RoundTrace` to record compressions into,
+                  message after message, as :class:`GOST341112` would
+    :returns: digests in the order of messages
+    :rtype: list of bytes
+    """
+    global _NP_TABLE_OFFSETS
+    messages = [memoryview(m).cast("B") for m in messages]
+    if digest_size not in (256, 512):
+        raise ValueError("Invalid digest size: %s" % digest_size)
+    if numpy is None:
+        return [GOST341112(m, digest_size, trace=trace).digest() for m in messages]
+    count = len(messages)
+    if count == 0:
+        return []
+    if _NP_TABLE_OFFSETS is None:
+        _NP_TABLE_OFFSETS = (numpy.arange(8, dtype=numpy.intp) * 256)[:, None]
+    u64 = numpy.dtype("<u8")
+    tables = numpy.array(LPS_TABLES, dtype=u64).reshape(-1)
+    consts = numpy.array(C_WORDS, dtype=u64)
+
+    lengths = numpy.array([len(m) for m in messages], dtype=numpy.int64)
+    nfull = lengths // BLOCKSIZE
+    order = numpy.argsort(-nfull, kind="stable")
+    nfull = nfull[order]
+    blocks = int(nfull[0])
+
+    # Full blocks of all messages packed back to back, row after row,
+    # so memory follows the total input size and not count times the
+    # longest message; block i of the active rows is gathered by offset
+    start = numpy.zeros(count, dtype=numpy.intp)
+    numpy.cumsum(nfull[:-1], out=start[1:])
+    full = numpy.empty(int(start[-1] + nfull[-1]) * 8, dtype=u64)
+    last = numpy.zeros((count, BLOCKSIZE), dtype=numpy.uint8)
+    for row, i in enumerate(order):
+        msg = messages[i]
+        end = int(nfull[row]) * BLOCKSIZE
+        if end:
+            offset = int(start[row]) * 8
+            full[offset:offset + end // 8] = numpy.frombuffer(msg[:end], dtype=u64)
+        tail = len(msg) - end
+        last[row, :tail] = numpy.frombuffer(msg[end:], dtype=numpy.uint8)
+        last[row, tail] = 1
+    last = last.view(u64)
+    full = full.reshape(-1, 8)
+
+    iv = 0x0101010101010101 if digest_size == 256 else 0
+    hsh = numpy.full((count, 8), iv, dtype=u64)
+    chk = numpy.zeros((count, 8), dtype=u64)
+    rounds = step = None
+    if trace is not None:
+        # Compressions of a message are contiguous, full blocks first,
+        # then the padded, length and checksum ones
+        first = start + 3 * numpy.arange(count, dtype=numpy.intp)
+        rounds = numpy.empty((len(full) + 3 * count, ROUNDS, 3, 8), dtype=u64)
+    active = numpy.searchsorted(-nfull, -numpy.arange(blocks), side="left")
+    for i in xrange(blocks):
+        rows = int(active[i])
+        msg = full[start[:rows] + i]
+        if rounds is not None:
+            step = numpy.empty((rows, ROUNDS, 3, 8), dtype=u64)
+        hsh[:rows] = _np_g(numpy.uint64(i * 512), hsh[:rows], msg, tables, consts, step)
+        if rounds is not None:
+            rounds[first[:rows] + i] = step
+        chk[:rows] = _np_add512(chk[:rows], msg)
+
+    def final_g(n, hsh, msg, i):
+        if rounds is None:
+            return _np_g(n, hsh, msg, tables, consts)
+        step = numpy.empty((count, ROUNDS, 3, 8), dtype=u64)
+        hsh = _np_g(n, hsh, msg, tables, consts, step)
+        rounds[first + nfull + i] = step
+        return hsh
+
+    n = (nfull * 512).astype(u64)
+    hsh = final_g(n, hsh, last, 0)
+    chk = _np_add512(chk, last)
+    nblock = numpy.zeros((count, 8), dtype=u64)
+    nblock[:, 0] = n + (lengths[order] - nfull * BLOCKSIZE).astype(u64) * 8
+    hsh = final_g(numpy.uint64(0), hsh, nblock, 1)
+    hsh = final_g(numpy.uint64(0), hsh, chk, 2)
+
+    if rounds is not None:
+        rows = numpy.empty(count, dtype=numpy.intp)
+        rows[order] = numpy.arange(count)
+        for row in rows:
+            offset = int(first[row])
+            trace.record_array(rounds[offset:offset + int(nfull[row]) + 3])
+
+    raw = hsh.tobytes()
+    res = [None] * count
+    for row, i in enumerate(order):
+        dgst = raw[row * BLOCKSIZE:(row + 1) * BLOCKSIZE]
+        res[i] = dgst[32:] if digest_size == 256 else dgst
+    return res
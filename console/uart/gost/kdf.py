@@ -0,0 +1,75 @@
+# coding: utf-8
+""" HMAC and KDF based on GOST R 34.11-2012 hash function
+This is implementation of HMAC_GOSTR3411_2012_256/512 and KDF_256 from
+R 50.1.113-2016 (:rfc:`7836`).
+
+Inner and outer pad states are hashed once per :class:`HMAC` object, so
+every further MAC under that key costs only the message blocks plus two
+finalizations. The module does not keep keys or pad states around, the
+one-shot functions prepare them per call.
+"""
+
+from .gost341112 import BLOCKSIZE
+from .gost341112 import GOST341112
+from .utils import hexenc
+
+
+class HMAC(object):
+    """ HMAC_GOSTR3411_2012 with precomputed pad states
+
+    >>> mac = HMAC(b"key", digest_size=256)
+    >>> tag = mac.digest(b"frame")
+    >>> tag == hmac_gostr3411_2012_256(b"key", b"frame")
+    True
+    """
+
+    def __init__(self, key, digest_size=256):
+        """
+        :param bytes key: secret key
+        :param digest_size: hash digest size to compute, in bits
+        :type digest_size: 256 or 512
+        """
+        key = bytes(key)
+        if len(key) > BLOCKSIZE:
+            key = GOST341112(key, digest_size).digest()
+        key = key.ljust(BLOCKSIZE, b'\x00')
+        self.digest_size = digest_size // 8
+        self._inner = GOST341112(bytes(b ^ 0x36 for b in key), digest_size)
+        self._outer = GOST341112(bytes(b ^ 0x5c for b in key), digest_size)
+
+    def digest(self, data):
+        """ Authentication tag of the data
+        """
+        inner = self._inner.copy()
+        inner.update(data)
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+    def hexdigest(self, data):
+        return hexenc(self.digest(data))
+
+
+def hmac_gostr3411_2012_256(key, data):
+    """ HMAC_GOSTR3411_2012_256
+    """
+    return HMAC(key, 256).digest(data)
+
+
+def hmac_gostr3411_2012_512(key, data):
+    """ HMAC_GOSTR3411_2012_512
+    """
+    return HMAC(key, 512).digest(data)
+
+
+def kdf_gostr3411_2012_256(key, label, seed):
+    """ KDF_256 key diversification
+
+    :param bytes key: initial key
+    :param bytes label: label
+    :param bytes seed: seed
+    :returns: 32 bytes of derived key
+    """
+    return hmac_gostr3411_2012_256(
+        key, b"\x01" + label + b"\x00" + seed + b"\x01\x00",
+    )
@@ -102,3 +102,24 @@ def modinvert(a, n):
     if t < 0:
         t = t + n
     return t
+
+
+def modinvert_many(values, n):
+    """ Modular multiplicative inverses of many numbers at once
+
+    :returns: list of inverses, computed with a single :func:`modinvert`
+
+    Montgomery's trick: invert the product of all numbers, then peel
+    separate inverses off it. All numbers must be invertible.
+    """
+    prefix = []
+    acc = 1
+    for value in values:
+        prefix.append(acc)
+        acc = acc * value % n
+    inv = modinvert(acc, n)
+    res = [0] * len(prefix)
+    for i in xrange(len(prefix) - 1, -1, -1):
+        res[i] = inv * prefix[i] % n
+        inv = inv * values[i] % n
+    return res
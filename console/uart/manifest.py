@@ -0,0 +1,214 @@
+"""
+Chunked digest manifest of big files
+File is split into chunk_size chunks, each one is hashed with Streebog
+on its own, so chunks are hashed in parallel processes and any range of
+them is re-verified without reading the rest of the file. Only the root
+of the hash tree over chunk digests is signed. Manifest layout:
+    header       magic, chunk size, file size, digest size, chunk count
+    digests      chunk count * digest size bytes
+    signature    SignatureSequence DER of the root, as der.py encodes
+Leaves are H(0x00 || chunk), tree nodes are H(0x01 || left || right), an
+odd node is carried up as is, and the signed digest is
+H(0x02 || chunk size || file size || tree root). Distinct prefixes keep a
+leaf from passing for a node or the root, and neither the chunking nor
+the file length can be changed unnoticed.
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, fstat
+from os.path import basename
+from struct import Struct
+
+from . import der
+from .gost import gost341012
+from .gost.gost341112 import GOST341112
+
+MAGIC = b'SIGMAN2\n'
+# magic, chunk size, file size, digest size in bytes, chunk count
+HEADER = Struct('<8sQQBQ')
+ROOT_PARAMS = Struct('<QQ')
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+ROOT_PREFIX = b'\x02'
+CHUNK_SIZE = 4 << 20
+# Chunks hashed by a worker process per task
+TASK_CHUNKS = 4
+
+Manifest = namedtuple('Manifest', ('chunk_size', 'filesize', 'digest_size', 'digests', 'signature'))
+ManifestCheck = namedtuple('ManifestCheck', ('signature', 'size', 'first', 'last', 'failed'))
+
+
+class ManifestError(ValueError):
+    """Raised on a malformed manifest or a bad chunk range."""
+
+
+def _hash(data, digest_size):
+    return GOST341112(data, digest_size * 8).digest()
+
+
+def _hash_range(path, chunk_size, digest_size, first, count):
+    """
+    Digests of count chunks starting with chunk first
+    """
+    digests = []
+    with open(path, 'rb') as file:
+        file.seek(first * chunk_size)
+        for _ in range(count):
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            leaf = GOST341112(LEAF_PREFIX, digest_size * 8)
+            leaf.update(chunk)
+            digests.append(leaf.digest())
+    return digests
+
+
+def chunk_count(filesize, chunk_size):
+    return (filesize + chunk_size - 1) // chunk_size
+
+
+def chunk_digests(path, chunk_size=CHUNK_SIZE, digest_size=32, first=0, last=None, workers=None):
+    """
+    Hash chunks first..last, both included, of the file
+    Chunks past the end of the file are missing from the result.
+    :param workers: hash in that many processes, all CPUs by default,
+                    in the calling thread if 1
+    :return: list of digests
+    """
+    if last is None:
+        with open(path, 'rb') as file:
+            last = chunk_count(fstat(file.fileno()).st_size, chunk_size) - 1
+    tasks = [
+        (path, chunk_size, digest_size, start, min(TASK_CHUNKS, last + 1 - start))
+        for start in range(first, last + 1, TASK_CHUNKS)
+    ]
+    workers = workers or cpu_count() or 1
+    if workers == 1 or len(tasks) < 2:
+        return [dgst for task in tasks for dgst in _hash_range(*task)]
+    digests = []
+    # Keep results in chunk order, and only a few tasks worth of chunks
+    # in flight, whatever the file size is
+    pending = deque()
+    with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+        for task in tasks:
+            if len(pending) >= workers * 2:
+                digests.extend(pending.popleft().result())
+            pending.append(pool.submit(_hash_range, *task))
+        while pending:
+            digests.extend(pending.popleft().result())
+    return digests
+
+
+def tree_root(digests, digest_size=32):
+    """
+    Root of the hash tree over chunk digests
+    """
+    level = list(digests)
+    if not level:
+        return _hash(b'', digest_size)
+    while len(level) > 1:
+        parents = [
+            _hash(NODE_PREFIX + level[i] + level[i + 1], digest_size)
+            for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0]
+
+
+def signed_digest(chunk_size, filesize, digests, digest_size=32):
+    """
+    Digest the manifest signature is made of
+    """
+    root = tree_root(digests, digest_size)
+    return _hash(ROOT_PREFIX + ROOT_PARAMS.pack(chunk_size, filesize) + root, digest_size)
+
+
+def sign_manifest(path, curve, prv, chunk_size=CHUNK_SIZE, digest_size=32, workers=None, pub=None):
+    """
+    Hash the file chunk by chunk and sign the tree root
+    :param int digest_size: Streebog digest size in bytes, 32 or 64
+    :param pub: public key of prv, computed if not given
+    :return: manifest bytes
+    """
+    if digest_size not in (32, 64):
+        raise ManifestError('Digest size is 32 or 64 bytes')
+    if chunk_size < 1:
+        raise ManifestError('Chunk size must be positive')
+    with open(path, 'rb') as file:
+        filesize = fstat(file.fileno()).st_size
+    digests = chunk_digests(path, chunk_size, digest_size, workers=workers)
+    if len(digests) != chunk_count(filesize, chunk_size):
+        raise ManifestError('File changed while hashed: {0}'.format(path))
+    if pub is None:
+        pub = gost341012.public_key(curve, prv)
+    signature = gost341012.sign(curve, prv, signed_digest(chunk_size, filesize, digests, digest_size))
+    return b''.join((
+        HEADER.pack(MAGIC, chunk_size, filesize, digest_size, len(digests)),
+        b''.join(digests),
+        der.encode_signature(curve, pub, signature, filename=basename(path), filesize=filesize),
+    ))
+
+
+def read_manifest(data):
+    """
+    Parse manifest bytes
+    :return: Manifest, signature is der.SignatureFields
+    """
+    if len(data) < HEADER.size:
+        raise ManifestError('Truncated manifest header')
+    magic, chunk_size, filesize, digest_size, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ManifestError('Not a manifest')
+    if not chunk_size or digest_size not in (32, 64) or count != chunk_count(filesize, chunk_size):
+        raise ManifestError('Inconsistent manifest header')
+    end = HEADER.size + count * digest_size
+    if len(data) < end:
+        raise ManifestError('Truncated manifest digests')
+    digests = [data[offset:offset + digest_size] for offset in range(HEADER.size, end, digest_size)]
+    try:
+        signature = der.decode_signature(data[end:])
+    except der.DERError as e:
+        raise ManifestError('Bad manifest signature: {0}'.format(e))
+    return Manifest(chunk_size, filesize, digest_size, digests, signature)
+
+
+def verify_manifest(path, manifest, curve, pub=None, first=0, last=None, workers=None, cache=None):
+    """
+    Check the manifest signature and re-hash chunks first..last of the file
+    Chunks are not hashed if the signature is bad.
+    :param Manifest manifest: as read_manifest gives
+    :param pub: expected signer public key, the one of the manifest if None
+    :param last: last chunk to check, included, the last one if None
+    :param PublicKeyCache cache: precomputed public key tables
+    :return: ManifestCheck, failed is a list of bad chunk numbers
+    """
+    count = len(manifest.digests)
+    if last is None:
+        last = count - 1
+    if first < 0 or first > last + 1 or last >= count:
+        raise ManifestError('Chunks {0}..{1} out of 0..{2}'.format(first, last, count - 1))
+    fields = manifest.signature
+    valid = (
+        (fields.p, fields.q, fields.a, fields.b, fields.x, fields.y) ==
+        (curve.p, curve.q, curve.a, curve.b, curve.x, curve.y) and
+        (pub is None or fields.pub == tuple(pub)) and
+        fields.filesize == manifest.filesize and
+        gost341012.verify(
+            curve, fields.pub,
+            signed_digest(manifest.chunk_size, manifest.filesize, manifest.digests, manifest.digest_size),
+            (fields.r, fields.s), cache=cache,
+        )
+    )
+    with open(path, 'rb') as file:
+        size = fstat(file.fileno()).st_size
+    if not valid:
+        return ManifestCheck(False, size == manifest.filesize, first, last, [])
+    digests = chunk_digests(path, manifest.chunk_size, manifest.digest_size, first, last, workers)
+    failed = [
+        number for number in range(first, last + 1)
+        if number - first >= len(digests) or digests[number - first] != manifest.digests[number]
+    ]
+    return ManifestCheck(True, size == manifest.filesize, first, last, failed)
@@ -7,9 +7,10 @@ import sys
 original_stdout = sys.stdout
 sys.stdout = open(os.devnull, 'w')
 
-from .gost.gost341012 import CURVE_PARAMS, CURVE_PARAMS_TEXT, GOST3410Curve, prv_unmarshal, public_key
+from .gost.gost341012 import CURVE_PARAMS, CURVE_PARAMS_TEXT, GOST3410Curve, private_key, public_key
 from .core import verify_file, VerificationError
 from .core import sign_file, SigningError
+from .core import write_keys
 from .strutils import truncate
 
 curve_params_sequence = ['p', 'q', 'a', 'b', 'x', 'y']
@@ -102,16 +103,8 @@ class Shell(Cmd):
         print('\nYou choose curve param set "{0}"'.format(param_index))
         curve = GOST3410Curve(*curve_params)
 
-        # Key length option is disabled, by default key size is 128 bits
-        # keysize = int(input('\nPlease, select keysize (in bits): '))
-        # while keysize < 16:
-        #     print('Wrong keysize! (must be >16)')
-        #     keysize = int(input('Select parameters index:'))
-        # keysize = keysize//8
-
-        keysize = 128
-
-        privkey = prv_unmarshal(os.urandom(keysize))
+        # Key length follows the curve, private key is uniform in [1, q - 1]
+        privkey = private_key(curve)
         pubkey = public_key(curve, privkey)
 
         key = {}
@@ -125,6 +118,26 @@ class Shell(Cmd):
         self.key = key
         return key
 
+    def do_genkeys_bulk(self, arg):
+        """
+        Generate key pairs into a file: genkeys_bulk [count] [filepath] [curve params idx]
+        """
+        args = arg.split()
+        if len(args) not in (2, 3):
+            print('Wrong params!')
+            return
+        count = assert_int(args[0])
+        if not count or count < 0:
+            return
+        indx = assert_int(args[2]) if len(args) == 3 else 1
+        if not indx or indx > len(CURVE_PARAMS.keys()) or indx < 1:
+            print('Wrong params set!')
+            return
+        curve = GOST3410Curve(*CURVE_PARAMS[list(CURVE_PARAMS.keys())[indx - 1]])
+        written = write_keys(args[1], curve, count)
+        print('{0} key pairs written to {1}'.format(written, args[1]))
+        return written
+
     def do_use(self, arg):
         """
         Use keys from available: use [keys idx]